@@ -9,7 +9,14 @@ DATA_DIR     = ROOT_DIR / ".agdata"
 VARS_FILE    = DATA_DIR / "vars.json"
 HISTORY_DIR  = DATA_DIR / "history"
 HISTORY_FILE = DATA_DIR / "history.json"
+SESSION_FILE = DATA_DIR / "session.jsonl"
+CATALOG_FILE = DATA_DIR / "catalog.db"
 SNIPPETS_DIR = DATA_DIR / "snippets"
+STATS_FILE   = DATA_DIR / "stats.jsonl"
+CASSETTE_DIR = DATA_DIR / "cassettes"
+SPILL_DIR    = DATA_DIR / "spill"
+MESSAGES_DIR = DATA_DIR / "messages"
+TASKS_DIR    = DATA_DIR / "tasks"
 
 # 历史记录文件格式
 HISTORY_FORMAT = r"%Y-%m-%d_%H-%M-%S"
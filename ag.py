@@ -1,19 +1,33 @@
 #!/bin/env python
+import sys
+import startup
+if __name__ == "__main__" and '--startup-profile' in sys.argv:
+    startup.begin()
 from _global import *
 
 import os
 import re
-import sys
 import json
 import time
 import argparse
 import readline
+import threading
+import subprocess
 import traceback
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from chat import Chat
-from deep import Deep
+from router import Route
+from governor import Governor
 import execute
+import telemetry
+from session import SessionLog
+from catalog import Catalog
+from snippets import SnippetStore
+from varcache import VarCache
+from messages import MessageStore
+import archive
 
 def complete_cd(text, state):
     # 仅当输入以 "cd " 开头时触发补全
@@ -34,19 +48,64 @@ class Agent:
         self.config = self.load_config()
         os.makedirs(ROOT_DIR / ".agdata", exist_ok=True)
         self.hist_path = HISTORY_FILE
-        self.history = self.load_history()
+        self.session = SessionLog(SESSION_FILE, self.config.get("session", {}).get("fsync", 1.0))
+        self.catalog = Catalog(CATALOG_FILE, HISTORY_DIR)
+        self.snippets = SnippetStore(SNIPPETS_DIR)
+        self.store = MessageStore(MESSAGES_DIR, self.config.get("memory"))
+        # 常驻内存的会话（最近使用的在最后）与后台归档写入
+        self.resident:OrderedDict[Path, dict[str, list]] = OrderedDict()
+        self.writer = archive.Writer(self.catalog.update)
+        self.history = self.recover_history()
+        # 会话最近一次写入归档时的消息数与代码片段数，为空时视为有改动
+        self.clean = None
+        self.store.compact(self.history)
         self.vars = self.load_vars()
 
-        self.chat = Chat(self.config["api_key"], self.config["base_url"])
-        self.deep = Deep(self.config["api_key"], self.config["base_url"])
+        # 执行器较轻，直接创建；对话对象依赖 openai 与 rich，在显示提示符后于后台导入并构建
+        self.executor = execute.Executor(self.config.get("exec"))
+        self.parts, self.warming = None, None
+        self.varcache = VarCache(self.run_var)
+        self.varcache.start(self.vars["bash"], self.vars["policy"])
         
         # 初始化系统提示
-        self.history['history'].insert(0, {
-            "role": "system",
-            "content": self.config["deep_prompt"] \
-                if self.config["deep"] else self.config["chat_prompt"]
-        })
+        system = self.config["deep_prompt"] if self.config["deep"] else self.config["chat_prompt"]
+        if len(self.history['history']) > 0 and self.history['history'][0]['role'] == 'system':
+            self.history['history'][0]['content'] = system
+        else:
+            self.history['history'].insert(0, {"role": "system", "content": system})
     
+    def warm_up(self):
+        """在后台线程中导入 openai、rich 等较重的模块并构建对话对象（已开始时跳过）"""
+        def build():
+            try:
+                import runner
+                self.parts = runner.build(self.config, executor=self.executor)
+            except BaseException as e:
+                self.parts = e
+        if self.warming is None:
+            self.warming = threading.Thread(target=build, name="warm-up", daemon=True)
+            self.warming.start()
+
+    def ready(self) -> tuple:
+        """等待后台构建完成"""
+        self.warm_up()
+        self.warming.join()
+        if isinstance(self.parts, BaseException):
+            raise RuntimeError("初始化对话失败") from self.parts
+        return self.parts
+
+    @property
+    def router(self):
+        return self.ready()[0]
+
+    @property
+    def chat(self):
+        return self.ready()[2]
+
+    @property
+    def deep(self):
+        return self.ready()[3]
+
     @staticmethod
     def load_config():
         with open(CONFIG_FILE, encoding="utf-8") as f:
@@ -57,11 +116,15 @@ class Agent:
             sys.exit(1)
         return config
 
+    @staticmethod
+    def read_history(path:Path) -> dict[str, list]:
+        """读取历史记录文件（压缩或未压缩）"""
+        return archive.read(path)
+
     def load_history(self, not_ok:bool=True):
         """加载对话历史"""
         if self.hist_path.exists():
-            with open(self.hist_path, encoding="utf-8") as f:
-                return json.load(f)
+            return self.read_history(self.hist_path)
         if not_ok:
             return {
                 'history': [],
@@ -70,56 +133,182 @@ class Agent:
         else:
             raise FileNotFoundError("History file is not exist.")
     
+    def recover_history(self):
+        """恢复未归档的会话：优先读取崩溃的进程留下的会话日志，其次兼容旧版的 history.json"""
+        def save(path:Path):
+            try:
+                history, target = SessionLog.read(path)
+                if len(history['history']) > 1:
+                    os.makedirs(HISTORY_DIR, exist_ok=True)
+                    target = target or self.new_path(path.stat().st_mtime)
+                    archive.write(target, history)
+                    self.catalog.update(target, history)
+                os.remove(path)
+            except (OSError, ValueError, KeyError):
+                pass
+        # 上次退出前未完成后台归档的会话
+        for path in SessionLog.parked(SESSION_FILE):
+            save(path)
+        # 其他进程仍在使用的日志不会被恢复；有多个崩溃的会话时恢复最近的一个，其余写入归档
+        orphans = SessionLog.orphans(SESSION_FILE)
+        for path in orphans[:-1]:
+            path = self.session.claim(path, current=False)
+            if path is not None:
+                save(path)
+        if len(orphans) > 0 and self.session.claim(orphans[-1]) is not None:
+            try:
+                history, path = SessionLog.read(self.session.path)
+            except (OSError, ValueError, KeyError):
+                return self.load_history()
+            if path is not None:
+                self.hist_path = path
+            self.session.archive = path
+            return history
+        return self.load_history()
+
     def load_vars(self):
         """加载变量"""
         if VARS_FILE.exists():
             with open(VARS_FILE, encoding="utf-8") as f:
-                return json.load(f)
+                return {"policy": {}} | json.load(f)
         return {
             "users": {},
-            "bash": {}
+            "bash": {},
+            "policy": {}
         }
     
+    def run_var(self, command:str, background:bool=False) -> str:
+        """执行终端命令变量，后台刷新时不读取终端输入"""
+        stdin = subprocess.DEVNULL if background else None
+        return execute.bash(command, self.executor.limits['user'], stdin)[0]
+
     def save_config(self):
         """保存配置"""
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
             json.dump(self.config, f, indent=2, ensure_ascii=False)
 
     def save_history(self):
-        """保存对话历史"""
-        with open(self.hist_path, "w", encoding="utf-8") as f:
-            json.dump(self.history, f, indent=2, ensure_ascii=False)
+        """保存对话历史：将新增的消息追加写入会话日志"""
+        self.session.sync(self.history)
     
+    def new_path(self, when:float=None) -> Path:
+        """新会话的归档路径"""
+        compress = self.config.get("archive", {}).get("compress", True)
+        name = time.strftime(HISTORY_FORMAT, time.localtime(when))
+        path, n = HISTORY_DIR / (name + (archive.SUFFIX if compress else ".json")), 0
+        # 同一秒内归档的多个会话
+        while path.exists() or path in self.resident or self.writer.dirty(path):
+            n += 1
+            path = HISTORY_DIR / (f"{name}_{n}" + (archive.SUFFIX if compress else ".json"))
+        return path
+
+    def archive_path(self) -> tuple[Path, Path]:
+        """当前会话的归档路径，以及需要被替换的旧版未压缩归档"""
+        if self.hist_path == HISTORY_FILE:
+            return self.new_path(), None
+        if self.config.get("archive", {}).get("compress", True) and not archive.compressed(self.hist_path):
+            # 继续的是旧版未压缩的会话：写入压缩归档后删除原文件
+            return self.hist_path.with_name(archive.stem(self.hist_path) + archive.SUFFIX), self.hist_path
+        return self.hist_path, None
+
+    def lengths(self) -> tuple[int, int]:
+        return len(self.history['history']), len(self.history['snippet'])
+
     def archive_history(self):
-        '''归档存储历史记录'''
-        if len(self.history['history']) <= 1: return 
+        '''归档存储历史记录：将会话日志整理为紧凑的（默认 gzip 压缩的）JSON 文件'''
+        if len(self.history['history']) <= 1:
+            self.session.discard()
+            return 
         os.makedirs(HISTORY_DIR, exist_ok=True)
-        if self.hist_path == HISTORY_FILE:
-            time_str = time.strftime(HISTORY_FORMAT, time.localtime())
-            self.hist_path = HISTORY_DIR / f"{time_str}.json"
-        self.save_history()
+        self.hist_path, legacy = self.archive_path()
+        self.writer.wait(self.hist_path)
+        archive.write(self.hist_path, self.history)
+        if legacy is not None:
+            os.remove(legacy)
+            self.catalog.remove(legacy)
+        self.catalog.update(self.hist_path, self.history)
+        self.session.discard()
         if os.path.exists(HISTORY_FILE):
             os.remove(HISTORY_FILE)
+
+    def suspend(self):
+        '''将当前会话移入常驻会话，有改动时保留会话日志并在后台写入归档'''
+        if len(self.history['history']) <= 1:
+            self.session.discard()
+            return
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        dirty = self.hist_path == HISTORY_FILE or self.lengths() != self.clean
+        self.save_history()
+        self.hist_path, legacy = self.archive_path()
+        if dirty or legacy is not None:
+            parked = self.session.park()
+            if legacy is not None:
+                self.catalog.remove(legacy)
+            old = HISTORY_FILE if HISTORY_FILE.exists() else None
+            self.writer.put(self.hist_path, self.history, [parked, legacy, old])
+        else:
+            self.session.discard()
+        self.resident[self.hist_path] = self.history
+        self.resident.move_to_end(self.hist_path)
+        while len(self.resident) > self.config.get("resident", 4):
+            self.resident.popitem(last=False)
+
+    def resume(self, path:Path):
+        '''切换到常驻会话：不读取归档，也不重新渲染'''
+        history = self.resident.pop(path)
+        self.suspend()
+        self.hist_path, self.history = path, history
+        self.clean = self.lengths()
+        self.session.attach(self.history, self.hist_path)
+        self.update_snippet()
     
     def save_vars(self):
         """保存变量"""
         with open(VARS_FILE, "w", encoding="utf-8") as f:
             json.dump(self.vars, f, indent=2, ensure_ascii=False)
 
+    def switch_history(self, path:Path):
+        """切换到已归档的会话，常驻内存的会话直接切换"""
+        if path == self.hist_path:
+            print("╰─  已经是当前会话")
+            return
+        if path in self.resident:
+            self.resume(path)
+            print(f"╰─  󰓩  已切换到常驻会话：{archive.stem(path)}")
+            return
+        self.writer.wait(path)
+        history = self.read_history(path)
+        self.suspend()
+        self.hist_path, self.history = path, history
+        self.store.compact(self.history)
+        print(f"├─    成功切换到历史记录：{archive.stem(self.hist_path)}")
+        record = input("├─  是否需要打印历史记录？[y/n]: ").lower()
+        if record == 'y':
+            self.terminal('clear', True)
+            _, result = self.chat._render_history(self.history)
+            self.history['snippet'] = result
+        else:
+            print(f"╰─────────────")
+        self.update_snippet()
+        self.clean = self.lengths()
+        # 继续已归档的会话：以其快照开始新的会话日志，归档时写回原文件
+        self.session.open(self.history, self.hist_path)
+
+    def checkpoint(self):
+        """每轮对话结束后更新代码片段并保存历史，本轮的消息转换为紧凑的记录"""
+        self.update_snippet()
+        self.save_history()
+        self.store.compact(self.history)
+
     def update_snippet(self):
-        os.makedirs(SNIPPETS_DIR, exist_ok=True)
-        for sid in range(len(self.history['snippet'])):
-            os.environ[f'S{sid}'] = str(SNIPPETS_DIR / f"{sid}")
-            with open(SNIPPETS_DIR / f"{sid}", "w", encoding="utf-8") as f:
-                f.write(self.history['snippet'][sid]['code'])
+        """将代码片段写入片段库（只写入新的片段），并更新 $S<sid>"""
+        self.snippets.export(self.history['snippet'])
 
-    def find_model(self, s:str):
+    def find_model(self, s:str) -> Route:
+        """根据模型名或别名查找模型路由"""
         for model in self.config["models"]:
-            if model["model"] == s:
-                return model["model"]
-            for alias in model["alias"]:
-                if alias == s:
-                    return model["model"]
+            if model["model"] == s or s in model["alias"]:
+                return self.router.route(model["model"])
         return None
     
     def get_user(self):
@@ -161,29 +350,40 @@ class Agent:
                     print("│   new    : 保存对话并开启新对话")
                     print("│   cls    : 清空屏幕，历史、变量均不会清空")
                     print("│   load   : 加载历史")
+                    print("│   switch <option:n>: 查看常驻内存的会话，或直接切换到第 n 个会话")
+                    print("│   search <query>: 全文搜索历史记录中的消息与代码片段，可直接切换到对应会话")
                     print("│   forget : 清空历史，变量不会清空")
                     print("│   change : 切换模型")
                     print("│   chat   : 切换到{}".format("普通对话" if self.config['deep'] else "深度对话"))
+                    print("│   race [first|all] <model...>: 多模型竞速（first）或并排对比（all），off 关闭")
                     print("│   func   : 查看自定义函数说明")
+                    print("│   stats <option:model> : 查看各模型的延迟与吞吐统计（p50/p95），支持正则")
+                    print("│   route <option:model> : 查看模型端点的路由状态（延迟、错误率、熔断），支持正则")
+                    print("│   kernel <option:restart|interrupt|reset>: 查看或控制常驻 Python 内核")
+                    print("│   shell <option:restart|interrupt>: 查看或控制深度对话使用的常驻 bash 会话")
+                    print("│   cache <option:clear>: 查看或清空只读命令的结果缓存")
                     print("│   bash   : 进入终端命令模式")
                     print("│   parse  : 解析输入为实际调用输入")
                     print("│   help   : 查看帮助")
                     print("│   exit   : 退出对话")
                     print("│   show <option:name>       : 打印变量，支持正则，无参数时打印所有变量")
                     print("│   snippet <option:language>: 查看代码片段，支持正则，无参数时打印所有变量")
+                    print("│   library <query>          : 在所有会话的代码片段库中搜索，可将片段加入当前会话")
                     print("├─    终端模式")
                     print("│   cd <path>            : 进入对应路径并将工作目录切换至该路径")
                     print("│   setr <name> <command>: 将终端命令运行结果保存在变量中")
                     print("│   setb <name> <command>: 将终端命令直接保存在变量中")
+                    print("│   fresh <name> <policy>: 设置终端变量的缓存策略：always | ttl <秒> | watch <路径...> | refresh <秒>")
                     print("│   <command>            : 执行终端命令（包括控制模式命令），可直接获取返回值")
                     print("│   exit                 : 退出终端模式，返回对话模式")
                     print("╰─────────────")
                 
                 case 'new':
-                    self.archive_history()
-                    self.hist_path = HISTORY_FILE
-                    self.history['history'] = [self.history['history'][0]]
-                    self.history['snippet'] = []
+                    system = self.history['history'][0]['content']
+                    self.suspend()
+                    self.hist_path, self.clean = HISTORY_FILE, None
+                    self.history = {"history": [{"role": "system", "content": system}], "snippet": []}
+                    self.update_snippet()
                     self.terminal('clear', True)
                 
                 case 'cls' | 'clear':
@@ -191,41 +391,77 @@ class Agent:
                 
                 case 'load':
                     print()
-                    print("╭─    历史记录")
-                    hist_files:list[Path] = []
-                    if HISTORY_DIR.exists():
-                        hist_files = [
-                            (i.stat().st_mtime, i) for i in list(HISTORY_DIR.iterdir())
-                        ]
-                        hist_files.sort(key=lambda x:x[0], reverse=True)
-                    for hid in range(len(hist_files)):
-                        print(f"│   {hid:3}: [{hist_files[hid][1].name.replace('.json', '')}] ", end="")
-                        with open(hist_files[hid][1], encoding="utf-8") as f:
-                            hist = json.load(f)
-                            if len(hist['history']) > 1:
-                                print(f"{self.short(hist['history'][1]['content'])!r}", end='')
-                        print()
-                    print("├─────────────")
-                    hist = input("│   请输入历史记录编号: ")
+                    print("╭─    历史记录")
+                    self.catalog.refresh(self.read_history)
+                    total, size, offset = self.catalog.count(), 20, 0
+                    while True:
+                        hist_files = self.catalog.page(offset, size)
+                        for hid, item in enumerate(hist_files, offset):
+                            model = f" <{item['model']}>" if item['model'] else ''
+                            print(f"│   {hid:3}: [{item['name']}]{model} {item['turns']} 轮 {self.short(item['title'])!r}")
+                        print(f"├─  第 {offset // size + 1}/{max(1, (total + size - 1) // size)} 页，共 {total} 条")
+                        hist = input("│   请输入历史记录编号（n 下一页，p 上一页）: ").strip()
+                        if hist == 'n' and offset + size < total:
+                            offset += size
+                        elif hist == 'p' and offset > 0:
+                            offset -= size
+                        elif hist not in ['n', 'p']:
+                            break
                     try:
-                        hist = int(hist)
+                        hist = int(hist) - offset
                         if hist >= 0 and hist < len(hist_files):
-                            self.hist_path:Path = hist_files[hist][1]
-                            self.history = self.load_history(False)
-                            print(f"├─    成功切换到历史记录：{self.hist_path.name.replace('.json', '')}")
-                            record = input("├─  是否需要打印历史记录？[y/n]: ").lower()
-                            if record == 'y':
-                                self.terminal('clear', True)
-                                _, result = self.chat._render_history(self.history)
-                                self.history['snippet'] = result
-                            else:
-                                print(f"╰─────────────")
-                            self.update_snippet()
+                            self.switch_history(Path(hist_files[hist]['path']))
                         else:
                             raise Exception("Records is not exist.")
                     except:
                         print(f"╰─    历史记录不存在")
                 
+                case 'switch':
+                    print()
+                    print("╭─  󰓩  常驻会话")
+                    sessions = list(reversed(self.resident))
+                    if args == '':
+                        current = "新会话" if self.hist_path == HISTORY_FILE else archive.stem(self.hist_path)
+                        info = archive.summarize(self.history)
+                        print(f"│     *: [{current}] {info['turns']} 轮 {self.short(info['title'])!r}（当前）")
+                        for sid, path in enumerate(sessions, 1):
+                            info = archive.summarize(self.resident[path])
+                            flag = "（写入中）" if self.writer.dirty(path) else ""
+                            print(f"│   {sid:3}: [{archive.stem(path)}] {info['turns']} 轮 {self.short(info['title'])!r}{flag}")
+                        for error in self.writer.errors:
+                            print(f"├─    归档失败：{error}")
+                        print("╰─  使用 /switch <n> 切换到对应会话")
+                    elif args.isdigit() and 0 < int(args) <= len(sessions):
+                        self.resume(sessions[int(args) - 1])
+                        print(f"╰─  已切换到：{archive.stem(self.hist_path)}")
+                    else:
+                        print("╰─    常驻会话不存在")
+                
+                case 'search':
+                    print()
+                    print(f"╭─    搜索历史：{args}")
+                    self.catalog.refresh(self.read_history)
+                    hits = self.catalog.search(args)
+                    if len(hits) == 0:
+                        print("╰─  没有找到匹配的记录")
+                    else:
+                        for hid, hit in enumerate(hits):
+                            where = f"$S{hit['sid']} [{hit['role']}]" if hit['sid'] is not None \
+                                else f"#{hit['turn']} {hit['role']}"
+                            text = ' '.join(hit['text'].split())
+                            print(f"│   {hid:3}: [{hit['name']}] {where}: {text}")
+                        print("├─────────────")
+                        hist = input("│   请输入编号切换到对应会话（回车跳过）: ").strip()
+                        try:
+                            if hist == '':
+                                print("╰─────────────")
+                            elif 0 <= int(hist) < len(hits):
+                                self.switch_history(Path(hits[int(hist)]['path']))
+                            else:
+                                raise Exception("Records is not exist.")
+                        except:
+                            print(f"╰─    历史记录不存在")
+                
                 case 'forget':
                     self.history['history'] = [self.history['history'][0]]
                     self.history['snippet'] = []
@@ -246,8 +482,9 @@ class Agent:
                         model = input("│   请输入模型或别名: ")
                     else:
                         model = args
-                    model = self.find_model(model)
-                    if model is not None:
+                    route = self.find_model(model)
+                    if route is not None:
+                        model = route.name
                         self.config["model"] = model
                         self.save_config()
                         print(f"╰─    成功切换到模型：{model}")
@@ -266,6 +503,37 @@ class Agent:
                     self.save_config()
                     print(f"╰─  已切换到{'深度对话' if self.config['deep'] else '普通对话'}")
                 
+                case 'race':
+                    print()
+                    print(f"╭─  󰓅  多模型竞速")
+                    params = args.split()
+                    if len(params) > 0 and params[0] in ['first', 'all']:
+                        mode = params.pop(0)
+                    else:
+                        mode = 'first'
+                    if args == 'off':
+                        self.config['race'] = None
+                        self.save_config()
+                        print(f"╰─  已关闭竞速模式")
+                    elif len(params) == 0:
+                        race = self.config.get('race')
+                        if race:
+                            print(f"╰─  当前模式：{race['mode']}，模型：{', '.join(race['models'])}")
+                        else:
+                            print(f"╰─  竞速模式未开启")
+                    else:
+                        routes = [self.find_model(m) for m in params]
+                        models = [None if r is None else r.name for r in routes]
+                        if None in models:
+                            print(f"╰─    模型不存在：{params[models.index(None)]}")
+                        elif len(set(models)) < 2:
+                            print(f"╰─    至少需要两个不同的模型")
+                        else:
+                            models = list(dict.fromkeys(models))
+                            self.config['race'] = {"mode": mode, "models": models}
+                            self.save_config()
+                            print(f"╰─    已开启{'竞速' if mode == 'first' else '对比'}模式：{', '.join(models)}")
+                
                 case 'show':
                     user_print, bash_print = False, False
                     def print_title(t:str):
@@ -286,9 +554,101 @@ class Agent:
                     for k, v in self.vars["bash"].items():
                         if args == '' or re.match(args, k):
                             print_title('b')
-                            print(f"│   {k:10} = {v!r}")
+                            policy = self.vars["policy"].get(k, {}).get('mode', 'always')
+                            age = self.varcache.age(k)
+                            fresh = f" [{policy}" + ("" if age is None else f"，{age:.0f}s 前") + "]"
+                            print(f"│   {k:10} = {v!r}{fresh}")
+                    print("╰─────────────")
+                
+                case 'stats':
+                    print()
+                    records = [r for r in telemetry.load_stats()
+                               if args == '' or re.match(args, r['model'])]
+                    print(f"╭─  󱎫  请求统计（共 {len(records)} 次，p50/p95）")
+                    def pair(v, unit='s'):
+                        return '-' if v is None else f"{v[0]:.2f}/{v[1]:.2f}{unit}"
+                    for model, item in telemetry.aggregate(records).items():
+                        print(f"├─  󱚣  {model}（{item['count']} 次，失败 {item['errors']} 次）")
+                        print(f"│   连接 {pair(item['connect'])}  首字 {pair(item['ttft'])}  总耗时 {pair(item['total'])}")
+                        print(f"│   回复 {pair(item['atps'], ' tok/s')}  思考 {pair(item['rtps'], ' tok/s')}")
+                        if item['gaps'] is not None:
+                            edges = [f"<{b}" for b in telemetry.GAP_BUCKETS] + [f">={telemetry.GAP_BUCKETS[-1]}"]
+                            gaps = ' '.join(f"{e}:{n}" for e, n in zip(edges, item['gaps']))
+                            print(f"│   块间间隔(ms) {gaps}")
+                    print("╰─────────────")
+                
+                case 'route':
+                    print()
+                    print(f"╭─  󰑪  端点路由")
+                    states = {'closed': '正常', 'half': '半开', 'open': '熔断'}
+                    for route in self.router.snapshot():
+                        if args != '' and not re.match(args, route.name):
+                            continue
+                        print(f"├─  󱚣  {route.name}")
+                        for ep in route.ranked():
+                            latency = '-' if ep.latency is None else f"{ep.latency:.2f}s"
+                            served = f" ({ep.model})" if ep.model else ''
+                            print(f"│   {ep.host}{served}: 延迟 {latency}，错误率 {ep.error_rate:.0%}，{states[ep.state]}")
+                    for error in self.router.errors:
+                        print(f"├─    健康检查出错：{error}")
                     print("╰─────────────")
                 
+                case 'kernel':
+                    print()
+                    kernel = self.executor.kernel
+                    if kernel is None:
+                        print("╰─  󰅙  未启用常驻 Python 内核（配置 exec.kernel.enable）")
+                    else:
+                        match args:
+                            case 'restart':
+                                kernel.restart()
+                            case 'interrupt':
+                                kernel.interrupt()
+                            case 'reset':
+                                kernel.reset()
+                        status = kernel.status()
+                        print(f"╭─    Python 内核")
+                        if not status['alive']:
+                            print("├─  未运行，下次执行时启动")
+                        else:
+                            rss = '-' if status['rss'] is None else f"{status['rss']} MB"
+                            limit = '不限' if kernel.memory is None else f"{kernel.memory} MB"
+                            print(f"│   PID {status['pid']}，已运行 {status['uptime']:.0f}s，执行 {status['count']} 次")
+                            print(f"│   内存 {rss}（上限 {limit}），预加载：{', '.join(kernel.preload) or '无'}")
+                            for error in status['errors']:
+                                print(f"│   预加载失败：{error}")
+                        print("╰─────────────")
+                
+                case 'shell':
+                    print()
+                    shell = self.executor.shell
+                    if shell is None:
+                        print("╰─  󰅙  未启用常驻 bash 会话（配置 exec.shell.enable）")
+                    else:
+                        match args:
+                            case 'restart':
+                                shell.restart()
+                            case 'interrupt':
+                                shell.interrupt()
+                        print(f"╭─    bash 会话")
+                        if not shell.alive():
+                            print("├─  未运行，下次执行时启动")
+                        else:
+                            print(f"│   PID {shell.proc.pid}，执行 {shell.count} 次，当前目录 {shell.cwd}")
+                        print("╰─────────────")
+                
+                case 'cache':
+                    print()
+                    cache = self.executor.cache
+                    if cache is None:
+                        print("╰─  󰅙  未启用结果缓存（配置 exec.cache.enable）")
+                    else:
+                        if args == 'clear':
+                            cache.clear()
+                        print(f"╭─    结果缓存（有效期 {cache.ttl}s）")
+                        print(f"│   条目 {len(cache.entries)} 个，命中 {cache.hits} 次，未命中 {cache.misses} 次")
+                        print("╰─────────────")
+                
                 case 'func':
                     print()
                     print(f"╭─    自定义函数")
@@ -315,6 +675,24 @@ class Agent:
                             print(f"│   $S{sid:<3} [{snippet['lang']:10}]: {content!r}")
                     print("╰─────────────")
                 
+                case 'library':
+                    print()
+                    print(f"╭─    代码片段库：{args}")
+                    hits = self.snippets.search(args)
+                    if len(hits) == 0:
+                        print("╰─  没有找到匹配的代码片段")
+                    else:
+                        for hid, hit in enumerate(hits):
+                            print(f"│   {hid:3}: [{hit['lang']:10}] {hit['lines']:4} 行 {self.short(hit['first'])!r}")
+                        print("├─────────────")
+                        hid = input("│   请输入编号将片段加入当前会话（回车跳过）: ").strip()
+                        if hid.isdigit() and int(hid) < len(hits):
+                            self.history['snippet'].append({"lang": hits[int(hid)]['lang'], "code": hits[int(hid)]['code']})
+                            self.update_snippet()
+                            print(f"╰─  已加入为 $S{len(self.history['snippet']) - 1}：{hits[int(hid)]['path']}")
+                        else:
+                            print("╰─────────────")
+                
                 case 'exit' | 'bye' | 'quit':
                     if single:
                         return 'exit'
@@ -347,7 +725,7 @@ class Agent:
                             else:
                                 raise ValueError(f"变量 {name} 不存在")
                         else:
-                            out, err, cost_time, returncode = execute.bash(command)
+                            out, err, cost_time, returncode = execute.bash(command, self.executor.limits['user'])
                             
                             exists = None
                             if name in self.vars["users"]:
@@ -384,6 +762,8 @@ class Agent:
                         if command == '':
                             if self.vars["bash"].get(name) is not None:
                                 self.vars["bash"].pop(name)
+                                self.vars["policy"].pop(name, None)
+                                self.varcache.invalidate(name)
                                 self.save_vars()
                                 print(f"╰─    变量 {name} 删除成功！")
                             else:
@@ -401,6 +781,7 @@ class Agent:
                                 else: raise KeyboardInterrupt
                             
                             self.vars["bash"][name] = command
+                            self.varcache.invalidate(name)
                             self.save_vars()
                             print(f"├─  {name} = {self.vars['bash'][name]!r}")
                             print(f"╰─    设置成功")
@@ -409,6 +790,37 @@ class Agent:
                     except Exception as e:
                         print(f"╰─    设置失败：{e}")
                 
+                case 'fresh':
+                    print()
+                    print(f"╭─    终端变量缓存策略")
+                    try:
+                        params = args.split()
+                        if len(params) == 0 or params[0] not in self.vars["bash"]:
+                            raise ValueError(f"终端变量 {params[0] if params else ''} 不存在")
+                        name, mode = params[0], params[1] if len(params) > 1 else 'always'
+                        if mode not in VarCache.MODES:
+                            raise ValueError(f"未知的策略 {mode}，可选：{' | '.join(VarCache.MODES)}")
+                        policy = {"mode": mode}
+                        if mode == 'ttl':
+                            policy['ttl'] = float(params[2]) if len(params) > 2 else 60
+                        elif mode == 'refresh':
+                            policy['interval'] = float(params[2]) if len(params) > 2 else 60
+                        elif mode == 'watch':
+                            if len(params) < 3:
+                                raise ValueError("watch 策略需要指定监视的路径")
+                            policy['paths'] = [os.path.abspath(os.path.expanduser(p)) for p in params[2:]]
+                        self.varcache.invalidate(name)
+                        if mode == 'always':
+                            self.vars["policy"].pop(name, None)
+                        else:
+                            self.vars["policy"][name] = policy
+                        self.varcache.start(self.vars["bash"], {name: policy})
+                        self.save_vars()
+                        print(f"├─  {name}: {policy}")
+                        print(f"╰─    设置成功")
+                    except Exception as e:
+                        print(f"╰─    设置失败：{e}")
+
                 case 'parse':
                     print()
                     print(f"╭─    解析输入")
@@ -419,7 +831,7 @@ class Agent:
                         print(f"╰─    解析失败：{traceback.format_exc()}")
                 
                 case _:
-                    out, err, cost_time, returncode = execute.bash(cmd)
+                    out, err, cost_time, returncode = execute.bash(cmd, self.executor.limits['user'])
                     print(out)
                     if returncode != 0:
                         print(f"├─────────────")
@@ -457,7 +869,7 @@ class Agent:
             # 终端命令变量
             val = self.vars["bash"].get(key)
             if val is not None:
-                return self.bash(val)[0]
+                return self.varcache.get(key, val, self.vars["policy"].get(key))
             # 代码片段
             if re.match(r"(\$S\d+[, ]*?)+", key):
                 sid_list, outputs = re.findall(r"\$S(\d+)", key), ''''''
@@ -468,15 +880,13 @@ class Agent:
                     if s['lang'] == 'json':
                         cmds = execute.check_parse(f"```json\n{s['code']}\n```")
                         if cmds is not None:
-                            opt, _ = execute.parse_and_exec(cmds)
+                            opt, _ = execute.parse_and_exec(cmds, self.executor, mode='user')
                             outputs += '\n ------ Run Result ------ \n'+opt
                         else:
                             outputs += '\n ------ json ------ \n'+s['code']
                     else:
                         outputs += '\n ------ '+s['lang']+' ------ \n'+s['code']
                 return outputs
-        # 替换变量
-        ipt = re.sub(r"{(.*?)}", replace_var, ipt)
         
         def replace_func(match:re.Match):
             try:
@@ -487,8 +897,44 @@ class Agent:
                     raise AttributeError(f"Unknown function: {name}")
             except:
                 return match.group(0)
-        # 处理函数
-        ipt = re.sub(r"@(.*?)\(([\s\S]*?)\)", replace_func, ipt, re.S)
+        
+        # 先收集所有占位符，在线程池中同时解析（相同的占位符只解析一次），再按原顺序替换
+        var_pattern, func_pattern = r"{(.*?)}", r"@(.*?)\(([\s\S]*?)\)"
+        if '{' not in ipt and '@' not in ipt:
+            return ipt
+        start, results, timings, children = time.time(), {}, {}, set()
+        def timed(resolve, match:re.Match):
+            begin = time.time()
+            try:
+                with execute.track(children):
+                    return resolve(match)
+            finally:
+                timings[match.group(0)] = time.time() - begin
+        def submit(pool, pattern, resolve, text, skip=None):
+            for match in re.finditer(pattern, text):
+                key = match.group(0)
+                if key not in results and (skip is None or not skip(key)):
+                    results[key] = pool.submit(timed, resolve, match)
+        def splice(pattern, text):
+            return re.sub(pattern, lambda m: results[m.group(0)].result() or '', text)
+        pool = ThreadPoolExecutor(self.config.get("prase_workers", 8))
+        try:
+            submit(pool, var_pattern, replace_var, ipt)
+            # 参数中不含变量的函数与变量同时解析，其余函数在变量替换后解析
+            submit(pool, func_pattern, replace_func, ipt, skip=lambda key: '{' in key)
+            ipt = splice(var_pattern, ipt)
+            submit(pool, func_pattern, replace_func, ipt)
+            ipt = splice(func_pattern, ipt)
+        except KeyboardInterrupt:
+            # 取消尚未开始的解析，结束正在执行的命令与代码片段，不等待工作线程退出
+            pool.shutdown(wait=False, cancel_futures=True)
+            execute.kill_tracked(children)
+            self.executor.abort.set()
+            raise
+        pool.shutdown()
+        if len(timings) > 0 and max(timings.values()) >= 0.1:
+            print(f"╭─  󱎫  占位符解析 {time.time() - start:.2f}s")
+            print("╰─  " + "，".join(f"{self.short(k)} {timings[k]:.2f}s" for k in results if k in timings))
         return ipt
 
     @staticmethod
@@ -509,36 +955,42 @@ class Agent:
             while True:
                 icon = '󰧑 ' if self.config['deep'] else '󱋊 '
                 print(f'\n╭─  {icon} {user_name}', flush=True)
+                self.warm_up()
                 user_input = self.input_lines(f"╰─  ").strip()
                 if len(user_input) > 0 and user_input[0] == '/':
                     ret = self.command(user_input[1:].strip())
                     if ret == 'exit':
                         break
+                    self.save_history()
                 else:
                     if self.config['deep']:
-                        self.history['history'][0]['content'] = self.config['deep_prompt']
+                        import runner
                         msg = self.prase(user_input)
-                        for round in range(20):
-                            status, cmd, _ = self.deep.chat(
+                        governor = Governor(self.config.get("governor"))
+                        runner.deep_loop(self.deep, governor, user_name, msg, self.history,
+                                         self.config["model"], after=self.checkpoint)
+                        if governor.rounds > 1:
+                            print(f"╭─  󰔟  预算")
+                            print(f"╰─  {governor.summary()}")
+                    else:
+                        self.history['history'][0]['content'] = self.config['chat_prompt']
+                        race = self.config.get('race')
+                        if race:
+                            status, _ = self.chat.race(
                                 user=user_name,
-                                msg=msg,
+                                msg=self.prase(user_input),
                                 history=self.history,
-                                model=self.config["model"],
-                                run=round > 0
+                                models=race['models'],
+                                mode=race['mode']
                             )
-                            self.update_snippet()
-                            if status == 'exec':
-                                msg = cmd
-                            else: break
-                    else:
-                        self.history['history'][0]['content'] = self.config['chat_prompt']
-                        status, _ = self.chat.chat(
-                            user=user_name,
-                            msg=self.prase(user_input),
-                            history=self.history,
-                            model=self.config["model"]
-                        )
-                        self.update_snippet()
+                        else:
+                            status, _ = self.chat.chat(
+                                user=user_name,
+                                msg=self.prase(user_input),
+                                history=self.history,
+                                model=self.config["model"]
+                            )
+                        self.checkpoint()
         except KeyboardInterrupt:
             print()
             print("╭─  󰈆  终止")
@@ -549,9 +1001,19 @@ class Agent:
             print(f"╰─  {traceback.format_exc()}")
         
         self.archive_history()
+        self.writer.close()
+        self.store.close()
 
-def main():
+def main(profile:bool=False):
     ai = Agent()
+    if profile:
+        # 只分析启动耗时：记录显示提示符的时间，等待后台预热完成后输出报告
+        startup.profile.mark("显示提示符")
+        ai.ready()
+        startup.profile.mark("后台预热完成")
+        startup.profile.report()
+        ai.executor.close()
+        return
     ai.main()
     return
 
@@ -559,10 +1021,27 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Agent")
     parser.add_argument("-l", "--local", action='store_true', help="Use local config (\"config-local.json\").")
     parser.add_argument("-c", "--config", type=str, help="Use custom config file.")
+    parser.add_argument("--startup-profile", action='store_true', help="Report the import-time breakdown of startup and exit.")
+    commands = parser.add_subparsers(dest="command")
+    tasks = commands.add_parser("run-tasks", help="Run Deep tasks from a JSONL file concurrently.")
+    tasks.add_argument("tasks", type=Path, help="Tasks file, one {\"prompt\": ...} per line.")
+    tasks.add_argument("-j", "--jobs", type=int, default=4, help="Number of tasks running at the same time.")
+    tasks.add_argument("-r", "--requests", type=int, help="Max concurrent model requests (default: jobs).")
+    tasks.add_argument("-o", "--output", type=Path, help="Results JSONL file (default: in the run directory).")
+    migrate = commands.add_parser("migrate-history", help="Compress archived history files (offline).")
+    migrate.add_argument("-j", "--jobs", type=int, default=4, help="Number of files compressed at the same time.")
     args = parser.parse_args()
     
     if args.local:
         CONFIG_FILE = CONFIG_FILE.parent / CONFIG_FILE.name.replace(".json", "-local.json")
     if args.config is not None:
         CONFIG_FILE = Path(args.config)
-    main()
+    if args.command == "run-tasks":
+        import runner
+        runner.run_tasks(Agent.load_config(), args.tasks, args.jobs, args.requests, args.output)
+    elif args.command == "migrate-history":
+        catalog = Catalog(CATALOG_FILE, HISTORY_DIR)
+        archive.migrate_all(HISTORY_DIR, catalog, args.jobs)
+        catalog.close()
+    else:
+        main(args.startup_profile)
@@ -0,0 +1,182 @@
+'''
+    历史记录归档文件的读写
+
+    压缩归档（.json.gz）为 gzip 压缩的两行文本：第一行为元数据（标题、模型、轮数等），
+    第二行为完整的历史记录。读取元数据只需解压第一行；旧版未压缩的 .json 文件可透明读取。
+'''
+import os
+import gzip
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+from collections import Counter
+
+SUFFIX = '.json.gz'
+FORMAT = 'ag-history'
+
+def summarize(history:dict[str, list]) -> dict:
+    '''
+        会话的目录信息：标题、首条消息、模型与轮数
+    '''
+    users = [m for m in history['history']
+             if m['role'] == 'user' and not m.get('metadata', {}).get('run', False)]
+    models = [m['metadata']['model'] for m in history['history']
+              if m['role'] == 'assistant' and 'model' in m.get('metadata', {})]
+    first = str(users[0]['content']) if len(users) > 0 else ''
+    return {
+        "title": ' '.join(first.split())[:60],
+        "first": first[:500],
+        "model": models[-1] if len(models) > 0 else None,
+        "turns": len(users)
+    }
+
+def compressed(path:Path) -> bool:
+    return str(path).endswith('.gz')
+
+def stem(path:Path) -> str:
+    '''
+        归档名（不含扩展名）
+    '''
+    return Path(path).name.split('.')[0]
+
+def write(path:Path, history:dict[str, list]):
+    '''
+        写入归档，扩展名为 .gz 时压缩并附带元数据
+    '''
+    if not compressed(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, separators=(',', ':'), default=dict)
+        return
+    header = {"format": FORMAT, "version": 1, "time": time.time()} | summarize(history)
+    # 先写入临时文件再替换，避免中断时损坏已有的归档
+    temp = Path(str(path) + '.tmp')
+    with gzip.open(temp, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        f.write(json.dumps(history, ensure_ascii=False, separators=(',', ':'), default=dict) + '\n')
+    os.replace(temp, path)
+
+def read(path:Path) -> dict[str, list]:
+    '''
+        读取归档（压缩或未压缩）
+    '''
+    if not compressed(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        f.readline()
+        return json.loads(f.readline())
+
+def meta(path:Path) -> dict:
+    '''
+        读取归档的元数据，压缩归档只解压第一行
+    '''
+    if not compressed(path):
+        return summarize(read(path))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.loads(f.readline())
+
+class Writer:
+    '''
+        后台归档写入：按提交顺序在单独的线程中写入，写入完成后调用 done(path, history)，
+        并删除 cleanup 中的文件（恢复用的会话日志、被替换的旧版归档）
+    '''
+    def __init__(self, done=None):
+        self.done = done
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.errors:list[str] = []
+        self.thread:threading.Thread = None
+
+    def put(self, path:Path, history:dict[str, list], cleanup:list[Path]=()):
+        # 浅拷贝：之后追加到会话中的消息不会影响本次写入
+        snapshot = {"history": list(history['history']), "snippet": list(history['snippet'])}
+        with self.lock:
+            self.pending[str(path)] += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, name="archive-writer", daemon=True)
+                self.thread.start()
+        self.queue.put((Path(path), snapshot, list(cleanup)))
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, history, cleanup = item
+            try:
+                write(path, history)
+                if self.done is not None:
+                    self.done(path, history)
+                for p in cleanup:
+                    if p is not None and os.path.exists(p):
+                        os.remove(p)
+            except Exception as e:
+                self.errors.append(f"{stem(path)}: {e}")
+            finally:
+                with self.lock:
+                    self.pending[str(path)] -= 1
+                    if self.pending[str(path)] <= 0:
+                        del self.pending[str(path)]
+
+    def dirty(self, path:Path) -> bool:
+        '''
+            会话是否还有未完成的写入
+        '''
+        with self.lock:
+            return str(path) in self.pending
+
+    def wait(self, path:Path):
+        '''
+            等待会话的写入完成
+        '''
+        while self.dirty(path) and self.thread is not None and self.thread.is_alive():
+            time.sleep(0.01)
+
+    def close(self):
+        '''
+            等待所有写入完成
+        '''
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+def migrate(path:Path) -> tuple[Path, int, int]:
+    '''
+        将未压缩的归档转换为压缩归档，保留修改时间，返回 (新路径, 原大小, 新大小)
+    '''
+    path = Path(path)
+    target = path.with_name(stem(path) + SUFFIX)
+    stat = path.stat()
+    write(target, read(path))
+    os.utime(target, (stat.st_atime, stat.st_mtime))
+    os.remove(path)
+    return target, stat.st_size, target.stat().st_size
+
+def migrate_all(directory:Path, catalog=None, jobs:int=4):
+    '''
+        并行压缩目录中所有未压缩的归档（离线执行），完成后更新会话目录
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    files = sorted(Path(directory).glob('*.json')) if Path(directory).exists() else []
+    print(f"╭─  󰛫  压缩历史记录：{len(files)} 个文件，并发 {jobs}")
+    before, after, failed = 0, 0, 0
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = {pool.submit(migrate, path): path for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                target, old, new = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"├─    {path.name}: {e}")
+                continue
+            before, after = before + old, after + new
+            if catalog is not None:
+                catalog.remove(path)
+                catalog.update(target, read(target))
+    ratio = f"，压缩率 {after / before:.1%}" if before > 0 else ''
+    print(f"╰─  完成：{len(files) - failed} 个成功，{failed} 个失败；"
+          f"{before / 1024:.1f} KiB → {after / 1024:.1f} KiB{ratio}")
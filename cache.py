@@ -0,0 +1,106 @@
+import os
+import time
+import shlex
+import threading
+from _global import DATA_DIR, SPILL_DIR, MESSAGES_DIR
+
+# 默认参与缓存键的环境变量
+CACHE_ENV = ["PATH", "HOME", "USER", "LANG", "LC_ALL", "VIRTUAL_ENV", "CONDA_PREFIX"]
+# 不展开 .git 目录，只检查这些会随提交、暂存与切换分支变化的文件
+GIT_FILES = ["HEAD", "index", "packed-refs", "FETCH_HEAD", "ORIG_HEAD"]
+# 不参与指纹的目录：Agent 自身的数据（每次执行都会写入 spill 文件、会话日志与目录）
+SKIP_DIRS = [DATA_DIR, SPILL_DIR, MESSAGES_DIR]
+
+class ResultCache:
+    '''
+        会话内的工具结果缓存，只缓存只读命令
+        键为 (工作目录, 命令, 环境变量子集)；工作目录下文件（以及命令参数中出现的文件）的修改时间变化，
+        或超过 ttl 秒后失效。工作目录下的条目超过 limit 个时不缓存。
+        Agent 的数据目录（SKIP_DIRS）不参与指纹，.git 只检查引用与 GIT_FILES
+    '''
+    def __init__(self, ttl:float=300, env:list[str]=None, limit:int=20000):
+        self.ttl, self.limit = ttl, limit
+        self.env = CACHE_ENV + (env or [])
+        self.entries:dict[tuple, tuple[float, tuple, dict]] = {}
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+        self.skip = {os.path.realpath(p) for p in SKIP_DIRS}
+        self.skip_names = {os.path.basename(p) for p in self.skip}
+
+    def key(self, cwd:str, cmd:dict) -> tuple:
+        return (cwd, cmd['name'], cmd['code'], tuple(os.environ.get(k) for k in self.env))
+
+    def fingerprint(self, cwd:str, code:str) -> tuple:
+        '''
+            工作目录的状态指纹 (条目数, 最新修改时间)，条目过多时返回 None
+        '''
+        count, latest = 0, 0
+        stack = [cwd]
+        try:
+            latest = os.stat(cwd).st_mtime_ns
+        except OSError:
+            return None
+        while len(stack) > 0:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.name in self.skip_names and os.path.realpath(entry.path) in self.skip:
+                        continue
+                    count += 1
+                    if count > self.limit:
+                        return None
+                    try:
+                        latest = max(latest, entry.stat(follow_symlinks=False).st_mtime_ns)
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                    except OSError:
+                        continue
+                    if entry.name == '.git':
+                        stack.append(os.path.join(entry.path, 'refs'))
+                        for name in GIT_FILES:
+                            try:
+                                latest = max(latest, os.stat(os.path.join(entry.path, name)).st_mtime_ns)
+                            except OSError:
+                                pass
+                    else:
+                        stack.append(entry.path)
+        # 命令参数中出现的文件（可能位于工作目录之外）
+        try:
+            tokens = shlex.split(code)
+        except ValueError:
+            tokens = code.split()
+        for token in tokens:
+            try:
+                latest = max(latest, os.stat(os.path.join(cwd, os.path.expanduser(token))).st_mtime_ns)
+            except (OSError, ValueError):
+                pass
+        return count, latest
+
+    def get(self, key:tuple, fingerprint:tuple) -> dict:
+        '''
+            查找未失效的结果，未命中时返回 None
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (time.time() - entry[0] > self.ttl or entry[1] != fingerprint):
+                self.entries.pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[2])
+
+    def put(self, key:tuple, fingerprint:tuple, result:dict):
+        with self.lock:
+            self.entries[key] = (time.time(), fingerprint, dict(result))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits, self.misses = 0, 0
+        self.skip = {os.path.realpath(p) for p in SKIP_DIRS}
+        self.skip_names = {os.path.basename(p) for p in self.skip}
@@ -0,0 +1,57 @@
+'''
+    cassette 的录制与匹配
+
+    cassette 为 JSONL 文件：第一行为元数据（模型、匹配键、时间），其后每行为一个数据块及其与上一块的时间间隔，
+    由 chat 在录制模式下写入，由 mock_server 回放。
+'''
+import json
+import time
+import hashlib
+from pathlib import Path
+
+def cassette_key(messages:list[dict]) -> str:
+    '''
+        cassette 的匹配键：最后一条消息内容的摘要
+    '''
+    content = messages[-1].get('content', '') if len(messages) > 0 else ''
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+class Recorder:
+    '''
+        包装真实的数据流，在迭代的同时将数据块与时间间隔录制为 cassette（JSONL）。
+        只能迭代一次：再次迭代时从上次的位置继续，不会重新打开（截断）cassette
+    '''
+    def __init__(self, response, path:Path, model:str, messages:list[dict]):
+        self.response, self.path = response, path
+        self.iterator = iter(response)
+        self.header = {"model": model, "key": cassette_key(messages), "time": time.time()}
+        self.last = self.header['time']
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.file.write(json.dumps(self.header, ensure_ascii=False) + '\n')
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.iterator)
+        except Exception:
+            # 数据流结束或出错，cassette 已完整
+            self.file.close()
+            raise
+        if hasattr(chunk, 'model_dump') and not self.file.closed:
+            now = time.time()
+            self.file.write(json.dumps({
+                "dt": round(now - self.last, 4),
+                "data": chunk.model_dump(exclude_none=True)
+            }, ensure_ascii=False) + '\n')
+            self.last = now
+        return chunk
+
+    def close(self):
+        self.file.close()
+        if hasattr(self.response, 'close'):
+            self.response.close()
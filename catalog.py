@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from archive import summarize, stem
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    path  TEXT PRIMARY KEY,
+    name  TEXT,
+    mtime REAL,
+    title TEXT,
+    first TEXT,
+    model TEXT,
+    turns INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessions_mtime ON sessions (mtime DESC);
+'''
+# 全文索引：trigram 分词可以匹配中文等不以空格分词的文本，旧版 SQLite 不支持时退回 unicode61
+DOCS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5 (
+    content, session UNINDEXED, turn UNINDEXED, sid UNINDEXED, role UNINDEXED, tokenize='{}'
+);
+'''
+# 目录结构的版本，升级时重建索引
+VERSION = 1
+
+def documents(history:dict[str, list]):
+    '''
+        会话中需要索引的文本：(内容, 消息序号, 代码片段序号, 角色)
+    '''
+    for turn, m in enumerate(history['history']):
+        if m['role'] == 'system':
+            continue
+        content = m.get('content')
+        text = content if isinstance(content, str) else ('' if content is None else str(content))
+        for call in m.get('tool_calls') or []:
+            text += '\n' + call['function']['arguments']
+        if text.strip():
+            yield text, turn, None, m['role']
+    for sid, snippet in enumerate(history['snippet']):
+        yield snippet['code'], None, sid, snippet.get('lang', '')
+
+class Catalog:
+    '''
+        已归档会话的 SQLite 目录，/load 直接分页读取而无需打开每个历史文件；
+        后台写入归档时会在其他线程中更新，所有操作由同一把锁保护
+    '''
+    def __init__(self, path:Path, directory:Path):
+        self.path, self.directory = Path(path), Path(directory)
+        self._db = None
+        self.lock = threading.RLock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+            try:
+                self._db.executescript(DOCS_SCHEMA.format('trigram'))
+            except sqlite3.OperationalError:
+                self._db.executescript(DOCS_SCHEMA.format('unicode61'))
+            if self._db.execute('PRAGMA user_version').fetchone()[0] < VERSION:
+                # 旧版目录没有全文索引，清空后由 refresh 重新索引所有会话
+                with self._db:
+                    self._db.execute('DELETE FROM sessions')
+                    self._db.execute('DELETE FROM docs')
+                    self._db.execute(f'PRAGMA user_version = {VERSION}')
+        return self._db
+
+    def update(self, path:Path, history:dict[str, list]):
+        '''
+            归档或保存会话后更新目录
+        '''
+        path = Path(path)
+        info = summarize(history)
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (str(path), stem(path), path.stat().st_mtime,
+                 info['title'], info['first'], info['model'], info['turns']))
+            self.db.execute('DELETE FROM docs WHERE session = ?', (str(path),))
+            self.db.executemany(
+                'INSERT INTO docs (content, session, turn, sid, role) VALUES (?, ?, ?, ?, ?)',
+                ((text, str(path), turn, sid, role) for text, turn, sid, role in documents(history)))
+
+    def remove(self, path:Path):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM sessions WHERE path = ?', (str(path),))
+            self.db.execute('DELETE FROM docs WHERE session = ?', (str(path),))
+
+    def refresh(self, load):
+        '''
+            与归档目录对账：只列出文件名，索引目录中没有的文件，删除已不存在的文件；
+            load(path) 用于读取新文件的历史记录
+        '''
+        with self.lock:
+            if not self.directory.exists():
+                return
+            files = {str(self.directory / name) for name in os.listdir(self.directory)
+                     if not name.endswith('.tmp')}
+            known = {row[0] for row in self.db.execute('SELECT path FROM sessions')}
+            for path in known - files:
+                self.remove(path)
+            for path in sorted(files - known):
+                try:
+                    self.update(path, load(Path(path)))
+                except (OSError, ValueError, KeyError):
+                    continue
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def page(self, offset:int=0, limit:int=20) -> list[dict]:
+        '''
+            按修改时间从新到旧分页读取
+        '''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT path, name, mtime, title, model, turns FROM sessions '
+                'ORDER BY mtime DESC LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+        return [dict(zip(['path', 'name', 'mtime', 'title', 'model', 'turns'], row)) for row in rows]
+
+    def search(self, query:str, limit:int=20) -> list[dict]:
+        '''
+            全文搜索消息与代码片段，按相关度排序；
+            不足三个字符的词无法使用 trigram 索引，改为逐条匹配
+        '''
+        terms = query.split()
+        long, short = [t for t in terms if len(t) >= 3], [t for t in terms if len(t) < 3]
+        where, params = [], []
+        if len(long) > 0:
+            where.append('docs MATCH ?')
+            params.append(' '.join('"' + t.replace('"', '""') + '"' for t in long))
+        for t in short:
+            where.append('instr(content, ?) > 0')
+            params.append(t)
+        if len(where) == 0:
+            return []
+        order = 'bm25(docs)' if len(long) > 0 else 's.mtime DESC'
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT d.session, s.name, d.turn, d.sid, d.role, snippet(docs, 0, '[', ']', '…', 12) "
+                f"FROM docs d JOIN sessions s ON s.path = d.session WHERE {' AND '.join(where)} "
+                f"ORDER BY {order} LIMIT ?", (*params, limit)).fetchall()
+        return [dict(zip(['path', 'name', 'turn', 'sid', 'role', 'text'], row)) for row in rows]
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,52 +1,226 @@
 import os
 import re
+import time
+import queue
+import threading
 import traceback
 from openai import OpenAI
-from render import MDStreamRenderer
+from _global import *
+from rich.live import Live
+from render import MDStreamRenderer, console, extract_snippets
+from race import Contender, SideBySide, wait_first, deadline_stream
+from telemetry import Meter
+from router import Router, Endpoint
+from cassette import Recorder
+from messages import payload
 
 class Chat:
-    def __init__(self, api_key:str, base_url:str):    
+    def __init__(self, api_key:str, base_url:str, timeout:dict=None, hedge:list[dict]=None,
+                 usage:bool=True, router:Router=None, record:bool=False):
+        '''
+            timeout: {"ttft": 首字超时秒数, "chunk": 块间超时秒数, "first": 所有请求产出首字的总时限（秒），
+                      缺省为 ttft ×（目标数 + 1），只有一个目标时为 ttft}
+            hedge  : 首字超时或请求失败时的备用请求，如 [{"model": ..., "base_url": ..., "api_key": ...}]，
+                     缺省字段沿用主请求的配置
+            usage  : 是否通过 stream_options.include_usage 请求用量统计
+            router : 模型到端点的路由，为空时所有模型使用 api_key/base_url
+            record : 是否将响应录制为 cassette，供 mock_server 回放
+        '''
         os.environ['all_proxy'] = ''
         os.environ['http_proxy'] = ''
         os.environ['https_proxy'] = ''
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+        self.timeout = timeout or {}
+        self.hedge = hedge or []
+        self.usage = usage
+        self.record = record
+        self.router = router or Router({
+            "api_key": api_key, "base_url": base_url, "router": {"health_interval": 0}
+        })
+        self.client = self.router.endpoint().client
     
-    def _render_response(self, response, snippet_start:int=0):
+    def _create(self, model:str, messages:list[dict], temperature:float=0.7, client:OpenAI=None,
+                tools:list[dict]=None):
+        '''
+            发起流式请求
+        '''
+        messages = payload(messages)
+        kwargs = {"stream_options": {"include_usage": True}} if self.usage else {}
+        if tools is not None:
+            kwargs["tools"] = tools
+        response = (client or self.client).chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **kwargs
+        )
+        if self.record:
+            time_str = time.strftime(HISTORY_FORMAT, time.localtime())
+            path = CASSETTE_DIR / f"{time_str}_{int(time.time()*1000)%1000:03}_{model.replace('/', '_')}.jsonl"
+            response = Recorder(response, path, model, messages)
+        return response
+
+    def _targets(self, model:str) -> list[tuple[str, str, Endpoint]]:
+        '''
+            候选请求目标 (显示的模型名, 请求的模型名, 端点)：
+            路由中的端点按延迟与错误率排序，其后为配置的备用请求
+        '''
+        targets = [(model, ep.model or model, ep) for ep in self.router.route(model).ranked()]
+        for backup in self.hedge:
+            name = backup.get('model') or model
+            targets.append((name, name, self.router.endpoint(backup.get('base_url'), backup.get('api_key'))))
+        return targets
+
+    def _open(self, model:str, messages:list[dict], temperature:float=0.7, meter:Meter=None,
+              tools:list[dict]=None):
+        '''
+            发起流式请求并等待首个有效数据块。首字超时或请求失败时，依次向下一个端点/备用模型
+            发起对冲请求，先产出数据者胜出，其余请求被取消；所有目标均已发起后，等待至有请求
+            产出数据、全部失败或超出首字总时限。返回实际使用的模型与数据流
+        '''
+        ttft, chunk = self.timeout.get('ttft'), self.timeout.get('chunk')
+        targets = self._targets(model)
+        if ttft is None and len(targets) == 1:
+            name, send, endpoint = targets[0]
+            try:
+                response = self._create(send, messages, temperature, endpoint.client, tools)
+            except Exception:
+                self.router.report(endpoint, error=True)
+                raise
+            if meter is not None:
+                meter.endpoint = endpoint
+                meter.connected()
+            return name, deadline_stream(response, chunk)
+
+        board, contenders, pending = queue.Queue(), [], []
+        def launch(target:tuple[str, str, Endpoint]):
+            name, send, endpoint = target
+            c = Contender(lambda: self._create(send, messages, temperature, endpoint.client, tools), name, board)
+            c.endpoint = endpoint
+            c.start()
+            contenders.append(c)
+            pending.append(c)
+
+        first = self.timeout.get('first')
+        if first is None and ttft is not None:
+            first = ttft * (len(targets) + 1 if len(targets) > 1 else 1)
+        deadline = None if first is None else time.time() + first
+        launch(targets[0])
+        try:
+            winner, stage = None, 0
+            while winner is None:
+                # 最后一个目标已发起后不再有可对冲的请求，等待任一请求产出、全部失败或到达首字总时限
+                last, error = stage + 1 >= len(targets), None
+                wait = ttft
+                if last:
+                    wait = None if deadline is None else max(0, deadline - time.time())
+                try:
+                    winner = wait_first(board, pending, wait)
+                except Exception as e:
+                    error = e
+                if winner is not None:
+                    break
+                if last:
+                    raise error or TimeoutError(f"{model} produced no token within {first}s.")
+                stage += 1
+                reason = f"请求失败（{error}）" if error is not None else f"首字超时 {ttft}s"
+                name, _, endpoint = targets[stage]
+                print(f"├─  󰓅  {reason}，对冲请求：{name} @ {endpoint.host}", flush=True)
+                launch(targets[stage])
+            if stage > 0:
+                print(f"├─  󰓅  {winner.model} @ {winner.endpoint.host} 胜出，首字 {winner.ttft:.2f}s", flush=True)
+        except BaseException:
+            for c in contenders:
+                c.cancel()
+                self._report(c)
+            raise
+        for c in contenders:
+            if c is not winner:
+                c.cancel()
+                self._report(c)
+        if meter is not None:
+            meter.model, meter.endpoint = winner.model, winner.endpoint
+            meter.endpoint_ttft = winner.ttft
+            meter.connected(winner.start_time + winner.connect)
+        return winner.model, deadline_stream(winner.stream(), chunk, winner.cancel)
+
+    def _report(self, c:Contender):
+        '''
+            将未胜出请求的结果反馈给路由：失败计入错误率，已产出首字时计入首字延迟，
+            否则已等待的时长作为延迟的下界
+        '''
+        if c.error is not None:
+            self.router.report(c.endpoint, error=True)
+        elif c.ttft is not None:
+            self.router.report(c.endpoint, c.ttft)
+        else:
+            self.router.penalize(c.endpoint, time.time() - c.start_time)
+
+    def _finish(self, meter:Meter, error:str=None):
+        '''
+            结束统计并将结果反馈给路由，延迟取端点自身的首字延迟
+        '''
+        meter.finish(error)
+        ttft = meter.ttft if meter.endpoint_ttft is None else meter.endpoint_ttft
+        self.router.report(meter.endpoint, ttft, error is not None)
+
+    @staticmethod
+    def _iter_deltas(response, meter:Meter=None, calls:dict=None):
+        '''
+            解析流式响应，逐个产出 (是否为思考内容, 文本)；
+            calls 不为空时，将工具调用的增量按序号累积到其中
+        '''
+        in_reasoning = 'False'
+        for chunk in response:
+            if meter is not None and getattr(chunk, 'usage', None) is not None:
+                meter.record_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if calls is not None and getattr(delta, 'tool_calls', None):
+                for tc in delta.tool_calls:
+                    call = calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                    call['id'] += tc.id or ''
+                    if tc.function is not None:
+                        call['name'] += tc.function.name or ''
+                        call['arguments'] += tc.function.arguments or ''
+            
+            content = ''
+            if hasattr(delta, 'reasoning_content') and delta.reasoning_content != None:
+                in_reasoning = 'Attr'
+                content = delta.reasoning_content
+            else:
+                if delta.content == '<think>':
+                    in_reasoning = 'Tag'
+                    content = ''
+                elif in_reasoning == 'Tag':
+                    if delta.content == '</think>':
+                        in_reasoning = 'False'
+                        content = ''
+                    else:
+                        content = delta.content
+                else:
+                    in_reasoning = 'False'
+                    content = delta.content
+            if content is None:
+                content = ''
+            if meter is not None:
+                meter.chunk(in_reasoning in ['Attr', 'Tag'], content)
+            yield in_reasoning in ['Attr', 'Tag'], content
+
+    def _render_response(self, response, snippet_start:int=0, meter:Meter=None, stop=None,
+                         calls:dict=None):
+        '''
+            渲染流式响应；stop(answer) 返回结束位置时，回复截断到该位置并关闭数据流；
+            calls 用于收集工具调用
+        '''
         reasoning_content, answer_content = "", ""
         is_reasoning, is_answering = False, False
 
         snippets = []
         with MDStreamRenderer(snippet_start) as markdown:
-            in_reasoning = 'False'
-            for chunk in response:
-                if not chunk.choices:
-                    continue
-                delta = chunk.choices[0].delta
-                
-                content = ''
-                if hasattr(delta, 'reasoning_content') and delta.reasoning_content != None:
-                    in_reasoning = 'Attr'
-                    content = delta.reasoning_content
-                else:
-                    if delta.content == '<think>':
-                        in_reasoning = 'Tag'
-                        content = ''
-                    elif in_reasoning == 'Tag':
-                        if delta.content == '</think>':
-                            in_reasoning = 'False'
-                            content = ''
-                        else:
-                            content = delta.content
-                    else:
-                        in_reasoning = 'False'
-                        content = delta.content
-                if content is None:
-                    content = ''
-                
-                if in_reasoning in ['Attr', 'Tag']:
+            for reasoning, content in self._iter_deltas(response, meter, calls):
+                if reasoning:
                     # 打印思考过程
                     if content != "" and is_reasoning == False:
                         print("├─  󰟷  THINK", flush=True)
@@ -65,9 +239,18 @@ class Chat:
                             print()
                         print("├─  󰛩  ANSWER", flush=True)
                         is_answering = True
+                    end = None
+                    if stop is not None and content != "":
+                        end = stop(answer_content + content)
+                        if end is not None:
+                            content = content[:max(0, end - len(answer_content))]
                     # 打印回复过程
                     markdown.update(content)
                     answer_content += content
+                    if end is not None:
+                        if hasattr(response, 'close'):
+                            response.close()
+                        break
             markdown._end()
             snippets += markdown.code_list
         if is_reasoning or is_answering:
@@ -102,14 +285,14 @@ class Chat:
                 s = item['reasoning']
                 for i in range(0, len(s), batch):
                     yield Chunk(s[i:i+batch], True)
-            s = item['content']
+            s = item.get('content') or ''
             for i in range(0, len(s), batch):
                 yield Chunk(s[i:i+batch])
 
         snippet = []
         for item in history['history']:
             metadata:dict = item.get('metadata', {})
-            if item['role'] == 'user':
+            if item['role'] in ['user', 'tool']:
                 if metadata.get('run', False):
                     print(f"╭─    运行结果")
                     print(item['content'])
@@ -124,6 +307,8 @@ class Chat:
                     result = self._render_response(
                         gen(item), len(snippet))
                     snippet += result['snippets']
+                    for call in item.get('tool_calls', []):
+                        print(f"├─ RUN {call['function']['name']}: {call['function']['arguments']}")
                 except:
                     print(traceback.format_exc())
                 print(f'╰─────────────')
@@ -131,21 +316,17 @@ class Chat:
     
     def chat(self, user:str, msg:str, history:dict[str, list], model:str, temperature:float=0.7):
         """对话，会修改传入的历史记录"""
+        meter = Meter(model, 'chat')
         try:
             history['history'].append({
                 "role": "user", "content": msg,
                 "metadata": { "user": user, "run": False, "deep": False }
             })
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=history['history'],
-                temperature=temperature,
-                stream=True
-            )
-
             print(f"╭─  󱚣  {model}")
-            result = self._render_response(response, len(history["snippet"]))
-            print('╰─────────────')
+            model, response = self._open(model, history['history'], temperature, meter)
+            result = self._render_response(response, len(history["snippet"]), meter)
+            self._finish(meter)
+            print(meter.border())
             history['snippet'] += result['snippets']
             history['history'].append({
                 "role": "assistant",
@@ -158,5 +339,136 @@ class Chat:
             print()
             print("╭─    中断")
             print("╰─  本轮对话已停止。")
+        except Exception as e:
+            self._finish(meter, str(e))
+            print()
+            print("╭─    请求失败")
+            print(f"╰─  {e}")
+        finally:
+            return 'finish', history
+
+    def _race_first(self, contenders:list[Contender], board:queue.Queue, snippet_start:int, meter:Meter):
+        '''
+            竞速模式：渲染首个产出数据的模型，取消其余请求
+        '''
+        winner = wait_first(board, list(contenders))
+        if winner is None:
+            raise RuntimeError("All models failed.")
+        for c in contenders:
+            if c is not winner:
+                c.cancel()
+        print(f"╭─  󱚣  {winner.model}  󰓅 {len(contenders)} 路竞速，首字 {winner.ttft:.2f}s")
+        meter.model, meter.endpoint = winner.model, winner.endpoint
+        meter.endpoint_ttft = winner.ttft
+        meter.connected(winner.start_time + winner.connect)
+        result = self._render_response(
+            deadline_stream(winner.stream(), self.timeout.get('chunk'), winner.cancel), snippet_start, meter)
+        self._finish(meter)
+        reports = []
+        for c in contenders:
+            if c is winner:
+                reports.append(c.report('winner'))
+            elif c.cancelled:
+                reports.append(c.report('cancelled'))
+            else:
+                reports.append(c.report(f'error: {c.error}'))
+        return winner.model, result, reports
+
+    def _race_all(self, contenders:list[Contender]):
+        '''
+            对比模式：并排渲染全部模型的回复
+        '''
+        columns = [
+            {"model": c.model, "answer": "", "reasoning": "", "status": "连接中"}
+            for c in contenders
+        ]
+        def consume(c:Contender, col:dict):
+            meter = Meter(c.model, 'race')
+            meter.start, meter.endpoint = c.start_time, c.endpoint
+            c.join()
+            try:
+                if c.error is not None:
+                    raise c.error
+                meter.connected(c.start_time + c.connect)
+                col['status'] = '生成中'
+                for reasoning, content in self._iter_deltas(c.stream(), meter):
+                    col['reasoning' if reasoning else 'answer'] += content
+                self._finish(meter)
+                col['status'] = meter.summary()
+            except Exception as e:
+                self._finish(meter, None if c.cancelled else str(e))
+                col['status'] = '已取消' if c.cancelled else '错误'
+                col['error'] = str(e)
+        threads = [
+            threading.Thread(target=consume, args=(c, col), daemon=True)
+            for c, col in zip(contenders, columns)
+        ]
+        for t in threads:
+            t.start()
+        print(f"╭─  󱚣  {' | '.join(c.model for c in contenders)}")
+        with Live(SideBySide(columns, console.height-1), console=console,
+                  refresh_per_second=10, transient=True):
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.1)
+        console.print(SideBySide(columns))
+
+        reports = []
+        for c, col in zip(contenders, columns):
+            report = c.report(col['status'])
+            report.update({"answer": col['answer'], "reasoning": col['reasoning']})
+            if 'error' in col:
+                report['error'] = col['error']
+            reports.append(report)
+        # 以首个成功的模型作为对话的延续
+        primary = next((col for col in columns if 'error' not in col), columns[0])
+        result = {
+            'answer'   : primary['answer'],
+            'reasoning': primary['reasoning'],
+            'snippets' : extract_snippets(primary['answer'])
+        }
+        return primary['model'], result, reports
+
+    def race(self, user:str, msg:str, history:dict[str, list], models:list[str],
+             mode:str='first', temperature:float=0.7):
+        """多模型竞速/对比，会修改传入的历史记录"""
+        contenders, meter = [], Meter(models[0], 'race')
+        try:
+            history['history'].append({
+                "role": "user", "content": msg,
+                "metadata": { "user": user, "run": False, "deep": False }
+            })
+            messages, board = list(history['history']), queue.Queue()
+            for model in models:
+                _, send, endpoint = self._targets(model)[0]
+                c = Contender(
+                    lambda s=send, ep=endpoint: self._create(s, messages, temperature, ep.client), model, board)
+                c.endpoint = endpoint
+                contenders.append(c)
+            for c in contenders:
+                c.start()
+
+            if mode == 'first':
+                model, result, reports = self._race_first(
+                    contenders, board, len(history['snippet']), meter)
+                print(meter.border())
+            else:
+                model, result, reports = self._race_all(contenders)
+                print('╰─────────────')
+            history['snippet'] += result['snippets']
+            history['history'].append({
+                "role": "assistant",
+                "content": result['answer'],
+                "metadata": { "model": model, "race": { "mode": mode, "results": reports } }
+            })
+            if result.get('reasoning', None) is not None:
+                history['history'][-1].update({"reasoning": result['reasoning']})
+        except KeyboardInterrupt:
+            for c in contenders:
+                c.cancel()
+            print()
+            print("╭─    中断")
+            print("╰─  本轮对话已停止。")
+        except Exception as e:
+            print(f"╰─    竞速失败：{e}")
         finally:
-            return 'finish', history
\ No newline at end of file
+            return 'finish', history
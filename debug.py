@@ -113,6 +113,25 @@ def raw():
     console.print(md)
     # print(md.parsed)
 
+def mock(port:int=8765, **kwargs):
+    '''
+        启动本地模拟服务，并通过真实的网络层进行一次对话
+    '''
+    import argparse
+    import threading
+    import mock_server
+    options = argparse.Namespace(
+        host='127.0.0.1', port=port, models=['mock'], ttft=0.3, tps=50, jitter=0.2,
+        tokens=120, reasoning=20, style='tag', tools=False, fail_rate=0.0, fail_modes=['500'],
+        stall=30, cassettes=None, speed=1.0, quiet=True)
+    vars(options).update(kwargs)
+    server = mock_server.serve(options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    chat = Chat('mock', f'http://127.0.0.1:{port}/v1')
+    history = {'history': [{"role": "system", "content": ""}], 'snippet': []}
+    chat.chat(user='debug', msg='你好', history=history, model='mock')
+    server.shutdown()
+
 def main():
     chat = Chat('', '')
     chat._render_response(gen(), 0)
@@ -121,6 +140,7 @@ def main():
 
 if __name__ == '__main__':
     raw()
+    # mock()
     # main()
     # parse()
     
\ No newline at end of file
@@ -1,50 +1,261 @@
-import os
-import re
 import json
-import traceback
-import subprocess
+import contextlib
+import threading
+
+import openai
 
 from chat import Chat
-from execute import check_parse, parse_and_exec
+from render import extract_snippets
+from telemetry import Meter
+from execute import Executor, check_parse, check_stream
 
-class Deep(Chat):
-    def chat(self, user:str, msg:str, history:dict[str, list], model:str, temperature:float=0.7, run:bool=False):
-        """对话，会修改传入的历史记录"""
-        try:
-            history['history'].append({
-                "role": "user", "content": msg,
-                "metadata": { "user": user, "run": run, "deep": True }
-            })
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=history['history'],
-                temperature=temperature,
-                stream=True
-            )
+# 原生工具调用模式下声明的工具
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": des,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "code": {"type": "string", "description": f"{name} code to execute"},
+                    "parallel": {
+                        "type": "boolean",
+                        "description": "只读且与本轮其他调用互不依赖时设为 true，以便并发执行"
+                    }
+                },
+                "required": ["code"]
+            }
+        }
+    } for name, des in [
+        ("python", "使用 python3 执行代码，返回 stdout（失败时返回 stderr）与退出码。"),
+        ("bash", "使用 bash 执行命令，返回 stdout（失败时返回 stderr）与退出码。")
+    ]
+]
 
-            print(f"╭─  󱚣  {model}")
-            result = self._render_response(response, len(history['snippet']))
-            history['snippet'] += result['snippets']
-            history['history'].append({
-                "role": "assistant", "content": result['answer'],
-                "metadata": { "model": model }
-            })
-            if result.get('reasoning', None) is not None:
-                history['history'][-1].update({"reasoning": result['reasoning']})
+# 原生工具调用模式下的系统提示
+TOOL_PROMPT = "你是一个智能助手，可以调用 python 和 bash 工具在用户的机器上执行代码。" \
+              "互不依赖的调用可以在一次回复中并行发起。请合理思考，灵活运用工具，" \
+              "根据运行结果灵活调整策略，帮助用户解决遇到的问题！"
+
+class Deep(Chat):
+    def __init__(self, *args, early_tool:str='cancel', tools:str='fence', prompts:dict=None,
+                 executor:Executor=None, gate=None, **kwargs):
+        '''
+            early_tool: 流式输出中出现完整的工具调用代码块时的处理方式
+                cancel : 立即停止接收并执行（默认）
+                overlap: 立即在后台开始执行，同时继续接收剩余输出
+                其他   : 等待输出结束后再解析执行
+            tools     : 工具调用方式
+                fence  : 通过提示词约定的 ```json 代码块调用（默认）
+                native : 通过接口的 tools/function calling 调用
+                auto   : 优先使用 native，端点不支持时回退到 fence
+            prompts   : 各工具调用方式的系统提示，如 {"fence": ..., "native": ...}
+            executor  : 工具调用的执行器
+            gate      : 限制同时进行的模型请求数的信号量（多任务并行时跨进程共享），为空时不限制
+        '''
+        super().__init__(*args, **kwargs)
+        self.early_tool = early_tool
+        self.tools = tools
+        self.executor = executor or Executor()
+        self.gate = gate or contextlib.nullcontext()
+        self.prompts = {"native": TOOL_PROMPT}
+        self.prompts.update({k: v for k, v in (prompts or {}).items() if v})
+        # 不支持原生工具调用的模型
+        self.fence_only = set()
+        # 最近一轮的统计与执行的工具调用，供预算与循环检测使用
+        self.last = {"meter": None, "commands": []}
 
-            commands = check_parse(result['answer'])
+    def _watch(self, found:dict):
+        '''
+            生成流式输出的监视函数，检测到完整的工具调用代码块时记录到 found 中
+        '''
+        def stop(answer:str):
+            if 'commands' in found:
+                return None
+            commands, end = check_stream(answer)
             if commands is None:
-                print('╰─────────────')
-                return 'finish', '', history
+                return None
+            found.update(commands=commands, end=end)
+            if self.early_tool == 'overlap':
+                def run():
+                    try:
+                        found['result'] = self.executor.parse_and_exec(commands)
+                    except Exception as e:
+                        found['error'] = e
+                found['thread'] = threading.Thread(target=run, daemon=True)
+                found['thread'].start()
+                return None
+            return end
+        return stop
+
+    def _system(self, history:dict[str, list], backend:str):
+        if backend in self.prompts:
+            history['history'][0]['content'] = self.prompts[backend]
+
+    @staticmethod
+    def _as_fence(messages:list[dict]) -> list[dict]:
+        '''
+            将原生工具调用的消息转换为代码块约定的格式，用于不支持工具调用的端点
+        '''
+        result = []
+        for m in messages:
+            if m['role'] == 'tool':
+                if len(result) > 0 and result[-1].get('metadata', {}).get('tool', False):
+                    result[-1]['content'] = result[-1]['content'][:-1] + ', ' + m['content'] + ']'
+                else:
+                    result.append({"role": "user", "content": '[' + m['content'] + ']',
+                                   "metadata": {"run": True, "deep": True, "tool": True}})
+            elif m['role'] == 'assistant' and m.get('tool_calls'):
+                calls = []
+                for call in m['tool_calls']:
+                    try:
+                        code = json.loads(call['function']['arguments']).get('code', '')
+                    except json.JSONDecodeError:
+                        code = call['function']['arguments']
+                    calls.append({"name": call['function']['name'], "code": code})
+                content = (m.get('content') or '')
+                content += ('\n' if content else '') + \
+                    f"```json\n{json.dumps(calls, ensure_ascii=False)}\n```"
+                result.append({k: v for k, v in m.items() if k != 'tool_calls'} | {"content": content})
             else:
-                # 解析出可执行代码
-                print('├─ RUN')
-                outputs, content = parse_and_exec(commands)
-                print(outputs, end='')
-                print('╰─────────────')
-                return 'exec', content, history
+                result.append(m)
+        return result
+
+    def chat(self, user:str, msg:str, history:dict[str, list], model:str, temperature:float=0.7, run:bool=False):
+        """对话，会修改传入的历史记录；msg 为 None 时表示工具结果已在历史记录中"""
+        meter = Meter(model, 'deep')
+        self.last = {"meter": meter, "commands": []}
+        try:
+            if msg is not None:
+                history['history'].append({
+                    "role": "user", "content": msg,
+                    "metadata": { "user": user, "run": run, "deep": True }
+                })
+            print(f"╭─  󱚣  {model}")
+            if self.tools in ['native', 'auto'] and model not in self.fence_only:
+                try:
+                    return self._chat_native(history, model, temperature, meter)
+                except openai.BadRequestError as e:
+                    if self.tools != 'auto':
+                        raise
+                    self.fence_only.add(model)
+                    print(f"├─  󰓅  端点不支持工具调用，回退到代码块模式（{e.status_code}）", flush=True)
+                    meter = Meter(model, 'deep')
+                    self.last['meter'] = meter
+            return self._chat_fence(history, model, temperature, meter)
         except KeyboardInterrupt:
+            # 终止提前启动（overlap）的工具调用
+            self.executor.abort.set()
             print()
-            print("╭─    中断")
+            print("╭─    中断")
             print("╰─  本轮对话已停止。")
-            return 'finish', '', history
\ No newline at end of file
+            return 'finish', '', history
+        except (TimeoutError, openai.OpenAIError) as e:
+            self._finish(meter, str(e))
+            print()
+            print("╭─    请求失败")
+            print(f"╰─  {e}")
+            return 'finish', '', history
+
+    def _chat_fence(self, history:dict[str, list], model:str, temperature:float, meter:Meter):
+        '''
+            代码块模式：解析回复中的 ```json 工具调用
+        '''
+        self._system(history, 'fence')
+        messages = self._as_fence(history['history'])
+        found = {}
+        stop = self._watch(found) if self.early_tool in ['cancel', 'overlap'] else None
+        with self.gate:
+            model, response = self._open(model, messages, temperature, meter)
+            result = self._render_response(response, len(history['snippet']), meter, stop)
+            self._finish(meter)
+        if 'commands' in found and len(result['answer']) > found['end']:
+            # 本轮输出以工具调用代码块的结束为止（overlap 模式下其后仍有输出），代码片段从截断后的回复中提取
+            result['answer'] = result['answer'][:found['end']]
+            result['snippets'] = extract_snippets(result['answer'])
+        history['snippet'] += result['snippets']
+        history['history'].append({
+            "role": "assistant", "content": result['answer'],
+            "metadata": { "model": model }
+        })
+        if result.get('reasoning', None) is not None:
+            history['history'][-1].update({"reasoning": result['reasoning']})
+
+        commands = found.get('commands') or check_parse(result['answer'])
+        if commands is None:
+            print(meter.border())
+            return 'finish', '', history
+        else:
+            # 解析出可执行代码
+            print('├─ RUN')
+            if 'thread' in found:
+                found['thread'].join()
+                if 'error' in found:
+                    raise found['error']
+                outputs, content = found['result']
+            else:
+                outputs, content = self.executor.parse_and_exec(commands, self.executor.options['live'])
+            print(outputs, end='')
+            print(meter.border())
+            self.last['commands'] = commands
+            return 'exec', content, history
+
+    def _chat_native(self, history:dict[str, list], model:str, temperature:float, meter:Meter):
+        '''
+            原生工具调用模式：流式接收 tool_calls，执行后以 tool 消息返回结果
+        '''
+        self._system(history, 'native')
+        calls = {}
+        with self.gate:
+            model, response = self._open(model, history['history'], temperature, meter, TOOLS)
+            result = self._render_response(response, len(history['snippet']), meter, calls=calls)
+            self._finish(meter)
+        history['snippet'] += result['snippets']
+        calls = [calls[i] for i in sorted(calls)]
+        message = {
+            "role": "assistant", "content": result['answer'] or None,
+            "metadata": { "model": model }
+        }
+        if len(calls) > 0:
+            message["tool_calls"] = [{
+                "id": call['id'], "type": "function",
+                "function": {"name": call['name'], "arguments": call['arguments']}
+            } for call in calls]
+        history['history'].append(message)
+        if result.get('reasoning', None) is not None:
+            history['history'][-1].update({"reasoning": result['reasoning']})
+
+        if len(calls) == 0:
+            print(meter.border())
+            return 'finish', '', history
+
+        # 同一轮中的多个调用一并执行，无效的调用直接返回错误
+        commands, errors = [], {}
+        for i, call in enumerate(calls):
+            try:
+                args = json.loads(call['arguments'] or '{}')
+                if call['name'] not in ['python', 'bash']:
+                    raise ValueError(f"Unknown tool: {call['name']}")
+                commands.append({"name": call['name'], "code": args['code'], "call": i})
+                if 'parallel' in args:
+                    commands[-1]['parallel'] = args['parallel']
+            except Exception as e:
+                errors[i] = {"exit": None, "error": f"Invalid tool call: {e}"}
+        print('├─ RUN')
+        if len(commands) > 0:
+            outputs, _ = self.executor.parse_and_exec(commands, self.executor.options['live'])
+            print(outputs, end='')
+        for i, error in errors.items():
+            print(f"[{calls[i]['name']}] {error['error']}")
+        results = {cmd.pop('call'): self.executor.compact(cmd) for cmd in commands} | errors
+        for i, call in enumerate(calls):
+            history['history'].append({
+                "role": "tool", "tool_call_id": call['id'],
+                "content": json.dumps(results[i], ensure_ascii=False),
+                "metadata": { "run": True, "deep": True }
+            })
+        print(meter.border())
+        self.last['commands'] = commands
+        return 'exec', None, history
@@ -5,30 +5,161 @@ import sys
 import json
 import time
 import base64
+import codecs
+import contextlib
+import signal
+import resource
+import tempfile
+import threading
 import traceback
 import subprocess
-import numpy as np
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from openai import OpenAI
 from _global import *
+from kernel import Kernel
+from shell import Shell
+from cache import ResultCache
 
-def bash(cmd):
+# 各模式的默认资源限制：time 运行时间（秒）、cpu CPU 时间（秒）、memory 地址空间（MB）、output 输出字节数；
+# deep 为模型发起的工具调用，user 为用户在终端模式或变量中执行的命令
+DEFAULT_LIMITS = {
+    "deep": {"time": 300, "cpu": None, "memory": None, "output": 64 * 1024 * 1024},
+    "user": {"time": None, "cpu": None, "memory": None, "output": None}
+}
+LIMIT_MESSAGES = {
+    "time"     : "超出运行时间限制（{} 秒），命令已被终止",
+    "cpu"      : "超出 CPU 时间限制（{} 秒），命令已被终止",
+    "memory"   : "可能超出内存限制（{} MB）",
+    "output"   : "输出超出限制（{} 字节），命令已被终止",
+    "interrupt": "命令被用户中断"
+}
+MEMORY_ERRORS = [b"MemoryError", b"Cannot allocate memory", b"std::bad_alloc", b"out of memory"]
+# 终止命令后等待其退出的时间（秒），超时后强制结束
+GRACE = 2
+
+def restrict(pid:int, limits:dict):
+    '''
+        子进程启动后通过 prlimit 设置其 CPU 时间与地址空间上限；不使用 preexec_fn，因为命令可能
+        在工作线程中启动。启动后立即结束的命令可能不受限制；进程已退出时忽略
+    '''
+    try:
+        if limits.get('cpu'):
+            cpu = int(limits['cpu'])
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu, cpu + 1))
+        if limits.get('memory'):
+            size = int(limits['memory']) * 1024 * 1024
+            resource.prlimit(pid, resource.RLIMIT_AS, (size, size))
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def killpg(pid:int, sig:int=signal.SIGKILL):
+    '''
+        向整个进程组发送信号
+    '''
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def kill_tree(pid:int, sig:int=signal.SIGKILL):
+    '''
+        向进程及其所有子孙进程发送信号，用于不在独立进程组中、无法使用 killpg 的命令
+    '''
+    children:dict[int, list[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    stack = [pid]
+    while len(stack) > 0:
+        p = stack.pop()
+        stack += children.get(p, [])
+        try:
+            os.kill(p, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+# 当前线程中 bash 启动的子进程登记到的集合，见 track
+_tracked = threading.local()
+
+@contextlib.contextmanager
+def track(children:set):
+    '''
+        将当前线程中 bash 启动的子进程 (pid, 是否在终端中执行) 登记到 children，
+        调用方在其他线程中被中断时可以通过 kill_tracked 结束这些命令
+    '''
+    _tracked.children = children
+    try:
+        yield children
+    finally:
+        _tracked.children = None
+
+def kill_tracked(children:set):
+    '''
+        结束登记的子进程：终端中的命令不是进程组组长，结束整个进程树
+    '''
+    for pid, terminal in list(children):
+        if terminal:
+            kill_tree(pid)
+        else:
+            killpg(pid)
+
+def bash(cmd, limits:dict=None, stdin=None):
     '''
-        使用 bash 命令执行
+        使用 bash 命令执行，stdin 默认为终端输入。
+        读取终端输入的命令留在终端的会话与前台进程组中，sudo、ssh 等才能通过 /dev/tty 提示输入，
+        Ctrl-C 也会直接送达命令；指定 stdin 的命令（如后台刷新）在新会话中执行，超时时结束整个进程组
     '''
+    limits = limits or DEFAULT_LIMITS['user']
+    terminal = stdin is None
     start_time = time.time()
     try:
-        result = subprocess.run(
-            cmd, shell=True, check=True, text=True, stdin=sys.stdin, capture_output=True)
-        cost_time = int((time.time() - start_time) * 1000)
-        return result.stdout.strip(), result.stderr.strip(), cost_time, result.returncode
-    except subprocess.CalledProcessError as e:
+        proc = subprocess.Popen(
+            cmd, shell=True, text=True, stdin=sys.stdin if terminal else stdin,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=not terminal)
+        restrict(proc.pid, limits)
+        children = getattr(_tracked, 'children', None)
+        if children is not None:
+            children.add((proc.pid, terminal))
+        try:
+            out, err = proc.communicate(timeout=limits.get('time'))
+        except subprocess.TimeoutExpired:
+            if terminal:
+                kill_tree(proc.pid)
+            else:
+                killpg(proc.pid)
+            try:
+                out, err = proc.communicate(timeout=GRACE)
+            except subprocess.TimeoutExpired:
+                # 仍有子进程持有输出管道，放弃剩余输出
+                out, err = '', ''
+                proc.wait()
+            err += '\n' + LIMIT_MESSAGES['time'].format(limits['time'])
+        except KeyboardInterrupt:
+            # 终端中的命令已收到 SIGINT，等待其退出
+            if not terminal:
+                killpg(proc.pid)
+            try:
+                proc.wait(GRACE)
+            except subprocess.TimeoutExpired:
+                kill_tree(proc.pid)
+                proc.wait()
+            raise
+        finally:
+            if children is not None:
+                children.discard((proc.pid, terminal))
         cost_time = int((time.time() - start_time) * 1000)
-        return e.stdout.strip(), e.stderr.strip(), cost_time, e.returncode
+        return out.strip(), err.strip(), cost_time, proc.returncode
+    except KeyboardInterrupt:
+        raise
     except Exception as e:
         cost_time = int((time.time() - start_time) * 1000)
-        return "\033[91m---   Unexcepted Error! ---\033[0m", traceback.format_exc(), cost_time, -1
+        return "\033[91m---   Unexcepted Error! ---\033[0m", traceback.format_exc(), cost_time, -1
 
 def check_parse(s:str):
     '''
@@ -58,40 +189,434 @@ def check_parse(s:str):
             pass
     return commands if len(commands) > 0 else None
 
-def parse_and_exec(commands:list[dict]):
+def check_stream(s:str):
     '''
-        解析并执行命令
+        检查流式输出的前缀中是否已出现完整的工具调用代码块，
+        返回 (命令, 代码块结束位置)，未出现时返回 (None, -1)
     '''
-    for cmd in commands:
-        res = None
-        if cmd['name'] == 'python':
-            if 'code' not in cmd:
-                raise Exception("Invalid Python call format")
-            ret = subprocess.run(['python3', '-c', cmd['code']], capture_output=True)
-            if ret.returncode == 0:
-                res = { "stdout": ret.stdout.decode('utf-8'), "exitcode": ret.returncode }
+    if s.count('```') < 2 or not s.lstrip().startswith('```json'):
+        return None, -1
+    m = re.match(r'\s*```json\n(.*?)\n```', s, re.S)
+    if m is None:
+        return None, -1
+    commands = check_parse(m.group(0))
+    return commands, (m.end() if commands is not None else -1)
+
+# 默认视为只读、可并发执行的 bash 命令
+READONLY_COMMANDS = [
+    r"git\s+(status|diff|log|show|rev-parse|describe|blame|ls-files)\b",
+    r"(ls|ll|cat|head|tail|wc|df|du|free|uname|whoami|pwd|which|type|printenv|ps|date|uptime|"
+    r"lsblk|lscpu|nproc|id|hostname|file|stat|find|grep|rg|tree|echo|realpath|readlink|md5sum|sha256sum)\b",
+    # env 后接命令时会执行该命令，只接受单独的 env
+    r"env\s*$",
+    r"\S+\s+(--version|-V|--help)\s*$"
+]
+
+# 只读命令中会写入文件、修改系统状态或执行其他命令的参数，出现时不视为只读
+WRITE_FLAGS = {
+    "find": r"\s-(delete|exec|execdir|ok|okdir|fprint|fprint0|fprintf|fls)\b",
+    "git" : r"\s--output\b",
+    "sort": r"\s(-[a-zA-Z]*o|--output\b)",
+    "tree": r"\s-o\b",
+    "rg"  : r"\s--pre\b",
+    "date": r"\s(-s|--set)\b",
+    "sed" : r"\s(-[a-zA-Z]*i|--in-place\b)"
+}
+
+# 只读但输出随时间变化、不应缓存的命令
+VOLATILE_COMMANDS = r"(date|uptime|ps|free|df|du|who|env|printenv)\b"
+
+class Executor:
+    '''
+        工具调用的执行器
+        options: {
+            "workers" : 并发执行的最大线程数，1 表示全部顺序执行,
+            "readonly": 额外视为只读（可并发）的 bash 命令正则,
+            "output"  : 每条命令保留的输出字节数，超出部分保留首尾并将完整输出写入 spill 文件,
+            "keep"    : spill 文件保留的天数,
+            "kernel"  : 常驻 Python 内核 {"enable": 是否启用, "preload": 预加载模块, "memory": 内存上限（MB）},
+            "shell"   : 常驻 bash 会话 {"enable": 是否启用},
+            "live"    : 顺序执行的命令是否实时显示输出,
+            "limits"  : 各模式（deep/user）的资源限制，覆盖 DEFAULT_LIMITS 中的对应项,
+            "cache"   : 只读命令的结果缓存 {"enable": 是否启用, "ttl": 有效期（秒）, "env": 额外参与缓存键的环境变量}
+        }
+        bash 会话在启动时使用 deep 模式的内存与 CPU 限制（CPU 时间对会话中的每条命令分别计算）；
+        内核在启动时使用内存限制，CPU 时间限制在每次执行时设置；运行时间与输出限制按调用检查
+    '''
+    def __init__(self, options:dict=None):
+        self.options = {"workers": 4, "readonly": [], "output": 8192, "keep": 7,
+                        "kernel": {}, "shell": {}, "live": True, "limits": {}, "cache": {}}
+        self.options.update(options or {})
+        self.readonly = [re.compile(p) for p in READONLY_COMMANDS + self.options['readonly']]
+        self.limits = {mode: limits | self.options['limits'].get(mode, {})
+                       for mode, limits in DEFAULT_LIMITS.items()}
+        # 置位后正在执行的命令会被终止，用于中断并发执行的批次
+        self.abort = threading.Event()
+        # 过期 spill 文件在首次执行命令时清理，创建执行器本身不删除文件
+        self.cleaned = False
+        self.kernel = None
+        kernel = self.options['kernel']
+        if kernel.get('enable', False):
+            # 启动时即预热内核，预加载在后台进行
+            self.kernel = Kernel(kernel.get('preload', []), kernel.get('memory') or self.limits['deep']['memory'])
+            self.kernel.start()
+        self.shell = Shell(restrict=lambda pid: restrict(pid, self.limits['deep'])) \
+            if self.options['shell'].get('enable', False) else None
+        cache = self.options['cache']
+        self.cache = ResultCache(cache.get('ttl', 300), cache.get('env')) \
+            if cache.get('enable', False) else None
+
+    def close(self):
+        '''
+            关闭常驻的内核与 bash 会话
+        '''
+        if self.kernel is not None:
+            self.kernel.close()
+        if self.shell is not None:
+            self.shell.close()
+
+    @property
+    def cwd(self) -> str:
+        '''
+            命令的工作目录：启用 bash 会话时跟随会话中的 cd
+        '''
+        return os.getcwd() if self.shell is None else self.shell.cwd
+
+    def _clean_spill(self):
+        '''
+            清理过期的 spill 文件
+        '''
+        if not SPILL_DIR.exists():
+            return
+        expire = time.time() - self.options['keep'] * 86400
+        for path in SPILL_DIR.iterdir():
+            try:
+                if path.stat().st_mtime < expire:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def _capture(self, path:str) -> tuple[str, str]:
+        '''
+            读取输出文件：未超出预算时读取全部并删除文件，
+            否则保留首尾各一半，返回 (输出, spill 文件路径)
+        '''
+        budget, size = self.options['output'], os.path.getsize(path)
+        with open(path, 'rb') as f:
+            if size <= budget:
+                text, spill = f.read().decode('utf-8', errors='replace'), None
             else:
-                res = { "stderr": ret.stderr.decode('utf-8'), "exitcode": ret.returncode }
-        elif cmd['name'] == 'bash':
-            if 'code' not in cmd:
-                raise Exception("Invalid bash call format")
-            ret = subprocess.run(cmd['code'], shell=True, capture_output=True)
-            if ret.returncode == 0:
-                res = { "stdout": ret.stdout.decode('utf-8'), "exitcode": ret.returncode }
+                head = f.read(budget // 2).decode('utf-8', errors='ignore')
+                f.seek(size - budget // 2)
+                tail = f.read().decode('utf-8', errors='ignore')
+                text, spill = head + f"\n... [省略 {size - budget} 字节，完整输出见 spill 文件] ...\n" + tail, path
+        if spill is None:
+            os.remove(path)
+        return text, spill
+
+    def _segments(self, cmd:dict) -> list[str]:
+        '''
+            只读的 bash 命令按管道与连接符拆分后的各段，非只读命令返回 None
+        '''
+        if cmd['name'] != 'bash':
+            return None
+        code = re.sub(r"\d?>&\d|2>\s*/dev/null", '', cmd['code'].strip())
+        if '\n' in code or '>' in code or '`' in code or '$(' in code:
+            return None
+        segments = [seg.strip() for seg in re.split(r"\|\||&&|;|\|", code) if seg.strip() != '']
+        for seg in segments:
+            flags = WRITE_FLAGS.get(seg.split()[0])
+            if flags is not None and re.search(flags, seg):
+                return None
+        return segments if all(any(p.match(seg) for p in self.readonly) for seg in segments) else None
+
+    def independent(self, cmd:dict) -> bool:
+        '''
+            判断命令是否与同批命令互不依赖：模型显式标记 parallel，或为只读的 bash 命令
+        '''
+        if 'parallel' in cmd:
+            return bool(cmd['parallel'])
+        return self._segments(cmd) is not None
+
+    def cacheable(self, cmd:dict) -> bool:
+        '''
+            判断命令结果是否可以缓存：只读且输出不随时间变化的 bash 命令
+        '''
+        segments = self._segments(cmd)
+        return segments is not None and not any(re.match(VOLATILE_COMMANDS, seg) for seg in segments)
+
+    def _check(self, start:float, paths:tuple[str, str], limits:dict) -> str:
+        '''
+            检查运行中的命令是否被中断或超出运行时间、输出限制，返回触发的限制
+        '''
+        if self.abort.is_set():
+            return 'interrupt'
+        if limits.get('time') and time.time() - start > limits['time']:
+            return 'time'
+        if limits.get('output') and sum(os.path.getsize(p) for p in paths) > limits['output']:
+            return 'output'
+        return None
+
+    @staticmethod
+    def _diagnose(returncode:int, err:str, limits:dict) -> str:
+        '''
+            根据退出码与错误输出判断命令是否因 CPU 或内存限制而失败
+        '''
+        if limits.get('cpu') and returncode in [-signal.SIGXCPU, 128 + signal.SIGXCPU]:
+            return 'cpu'
+        if limits.get('memory') and returncode != 0:
+            with open(err, 'rb') as f:
+                f.seek(max(0, os.path.getsize(err) - 4096))
+                tail = f.read()
+            if returncode in [-signal.SIGKILL, 137] or any(e in tail for e in MEMORY_ERRORS):
+                return 'memory'
+        return None
+
+    def _follow(self, job, stop, kill, paths:tuple[str, str], live:bool, limits:dict) -> tuple[int, str]:
+        '''
+            在后台线程中执行 job 并等待其结束，live 时实时回显输出文件的新增内容；
+            超出限制或被中断时先调用 stop 终止命令，GRACE 秒后仍未结束则调用 kill，
+            Ctrl-C 时终止命令后重新抛出。返回 (退出码, 触发的限制)
+        '''
+        box = {}
+        def target():
+            try:
+                box['code'] = job()
+            except BaseException as e:
+                box['error'] = e
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        echo = Echo(paths, self.options['output']) if live else None
+        start, limit, stopped, killed = time.time(), None, None, False
+        try:
+            while thread.is_alive():
+                thread.join(0.05)
+                if echo is not None:
+                    echo.poll()
+                if stopped is None:
+                    limit = self._check(start, paths, limits)
+                    if limit is not None:
+                        stop()
+                        stopped = time.time()
+                elif not killed and time.time() - stopped > GRACE:
+                    kill()
+                    killed = True
+        except KeyboardInterrupt:
+            stop()
+            thread.join(GRACE)
+            if thread.is_alive():
+                kill()
+                thread.join()
+            raise
+        finally:
+            if echo is not None:
+                echo.close()
+        if 'error' in box:
+            raise box['error']
+        return box['code'], limit
+
+    def run(self, cmd:dict, live:bool=False, mode:str='deep', session:bool=True) -> dict:
+        '''
+            执行单条命令；启用缓存时，只读命令优先使用未失效的缓存结果（结果中标记 cached）
+        '''
+        if self.cache is None or not self.cacheable(cmd):
+            return self._execute(cmd, live, mode, session)
+        cwd = self.cwd
+        key, fingerprint = self.cache.key(cwd, cmd), self.cache.fingerprint(cwd, cmd['code'])
+        if fingerprint is None:
+            return self._execute(cmd, live, mode, session)
+        res = self.cache.get(key, fingerprint)
+        if res is not None:
+            return res | {"cached": True}
+        res = self._execute(cmd, live, mode, session)
+        if 'limit' not in res:
+            self.cache.put(key, fingerprint, res)
+        return res
+
+    def _execute(self, cmd:dict, live:bool=False, mode:str='deep', session:bool=True) -> dict:
+        '''
+            执行单条命令，输出直接写入文件而非内存，返回有界的结果；
+            触发资源限制时在结果中记录 limit，并在错误输出中说明。
+            session 为 False 时不使用常驻的内核与 bash 会话，而是启动独立的子进程：
+            常驻进程同一时间只能执行一条命令，且超时中断会影响其中正在执行的其他命令
+        '''
+        # applied 为实际生效的限制，常驻进程的内存与 CPU 限制在启动时设置，与本次调用的模式无关
+        limits = applied = self.limits[mode]
+        if not self.cleaned:
+            self.cleaned = True
+            self._clean_spill()
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        prefix = time.strftime(HISTORY_FORMAT, time.localtime())
+        with tempfile.NamedTemporaryFile(dir=SPILL_DIR, prefix=f'{prefix}_', suffix='.out', delete=False) as out, \
+             tempfile.NamedTemporaryFile(dir=SPILL_DIR, prefix=f'{prefix}_', suffix='.err', delete=False) as err:
+            if cmd['name'] == 'python' and self.kernel is not None and session:
+                job = lambda: self.kernel.run(cmd['code'], out.name, err.name, self.cwd, limits.get('cpu'))
+                stop, kill = self.kernel.interrupt, self.kernel.kill
+                applied = limits | {"memory": self.kernel.memory}
+            elif cmd['name'] == 'bash' and self.shell is not None and session:
+                job = lambda: self.shell.run(cmd['code'], out.name, err.name)
+                stop, kill = self.shell.interrupt, self.shell.kill
+                applied = limits | {key: self.limits['deep'][key] for key in ['cpu', 'memory']}
             else:
-                res = { "stderr": ret.stderr.decode('utf-8'), "exitcode": ret.returncode }
-        cmd.update(res)
-    
-    outputs = '''''' 
-    for cmd in commands:
-        outputs += f'[{cmd["name"]}] {cmd["code"]!r}'
+                args = ['python3', '-c', cmd['code']] if cmd['name'] == 'python' else cmd['code']
+                proc = subprocess.Popen(args, shell=cmd['name'] == 'bash', stdin=subprocess.DEVNULL,
+                                        stdout=out, stderr=err, cwd=self.cwd, start_new_session=True)
+                restrict(proc.pid, limits)
+                job = proc.wait
+                stop, kill = lambda: killpg(proc.pid, signal.SIGTERM), lambda: killpg(proc.pid)
+            returncode, limit = self._follow(job, stop, kill, (out.name, err.name), live, limits)
+        limit = limit or self._diagnose(returncode, err.name, applied)
+        if limit is not None:
+            with open(err.name, 'a', encoding='utf-8') as f:
+                f.write(f"\n[limit] {LIMIT_MESSAGES[limit].format(applied.get(limit))}\n")
+        failed = returncode != 0 or limit is not None
+        keep, drop = (err.name, out.name) if failed else (out.name, err.name)
+        os.remove(drop)
+        text, spill = self._capture(keep)
+        res = { "stderr" if failed else "stdout": text, "exitcode": returncode }
+        if limit is not None:
+            res["limit"] = limit
+        if spill is not None:
+            res["spill"] = spill
+        return res
+
+    @staticmethod
+    def compact(cmd:dict) -> dict:
+        '''
+            返回给模型的精简结果（不回显代码）
+        '''
+        res = {"exit": cmd.get('exitcode')}
+        for key in ['stdout', 'stderr', 'limit', 'cached', 'spill', 'error']:
+            if key in cmd:
+                res[key] = cmd[key]
+        return res
+
+    def batches(self, commands:list[dict]) -> list[list[int]]:
+        '''
+            将命令划分为批次：连续的独立命令为一批并发执行，其余命令单独成批
+        '''
+        batches, current = [], []
+        for i, cmd in enumerate(commands):
+            if self.options['workers'] > 1 and self.independent(cmd):
+                current.append(i)
+                continue
+            if len(current) > 0:
+                batches.append(current)
+                current = []
+            batches.append([i])
+        if len(current) > 0:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def format(cmd:dict) -> str:
+        '''
+            格式化单条命令的执行结果，用于显示
+        '''
+        output = f'[{cmd["name"]}] {cmd["code"]!r}'
+        cached = '[cached]' if cmd.get('cached') else ''
         if 'stdout' in cmd:
-            outputs += f' -> stdout[ExitCode: 0]\n'
-            outputs += cmd['stdout']+'\n'
+            output += f' -> stdout[ExitCode: 0]{cached}\n'
+            output += cmd['stdout']+'\n'
         if 'stderr' in cmd:
-            outputs += f' -> stderr[ExitCode: {cmd["exitcode"]}]\n'
-            outputs += cmd['stderr']+'\n'
-    return outputs, json.dumps(commands, ensure_ascii=False)
+            output += f' -> stderr[ExitCode: {cmd["exitcode"]}]{cached}\n'
+            output += cmd['stderr']+'\n'
+        if 'spill' in cmd:
+            output += f'[spill] {cmd["spill"]}\n'
+        return output
+
+    def parse_and_exec(self, commands:list[dict], live:bool=False, mode:str='deep'):
+        '''
+            解析并执行命令，互不依赖的命令并发执行，输出顺序与命令顺序一致；
+            并发执行的命令使用独立的子进程，常驻的内核与 bash 会话只用于顺序执行的命令；
+            live 时直接打印结果，顺序执行的命令实时显示输出，返回的输出为空
+        '''
+        for cmd in commands:
+            if 'code' not in cmd:
+                raise Exception(f"Invalid {cmd['name']} call format")
+        self.abort.clear()
+        outputs = '''''' 
+        for batch in self.batches(commands):
+            if len(batch) == 1:
+                cmd = commands[batch[0]]
+                if live:
+                    print(f'[{cmd["name"]}] {cmd["code"]!r}', flush=True)
+                cmd.update(self.run(cmd, live, mode))
+                if live and cmd.get('cached'):
+                    # 缓存命中时没有实时输出，直接显示缓存的结果
+                    text = cmd.get('stdout', cmd.get('stderr', ''))
+                    print(text, end='' if text.endswith('\n') else '\n')
+                if live:
+                    print(f'[ExitCode: {cmd["exitcode"]}]' + ('[cached]' if cmd.get('cached') else '') + ''.join(
+                        f' [{key}] {cmd[key]}' for key in ['limit', 'spill'] if key in cmd))
+                else:
+                    outputs += self.format(cmd)
+                continue
+            with ThreadPoolExecutor(max_workers=min(self.options['workers'], len(batch))) as pool:
+                futures = [pool.submit(self.run, commands[i], False, mode, False) for i in batch]
+                try:
+                    while len(wait(futures, timeout=0.1).not_done) > 0:
+                        pass
+                except KeyboardInterrupt:
+                    # 终止同批次中所有正在执行的命令
+                    self.abort.set()
+                    wait(futures)
+                    raise
+                for i, future in zip(batch, futures):
+                    commands[i].update(future.result())
+            block = ''.join(self.format(commands[i]) for i in batch)
+            if live:
+                print(block, end='')
+            else:
+                outputs += block
+        return outputs, json.dumps(
+            [{"id": i} | self.compact(cmd) for i, cmd in enumerate(commands)], ensure_ascii=False)
+
+class Echo:
+    '''
+        实时回显输出文件的新增内容，最多显示 budget 字节
+    '''
+    def __init__(self, paths:tuple[str, str], budget:int):
+        self.files = [open(p, 'rb') for p in paths]
+        self.decoders = [codecs.getincrementaldecoder('utf-8')(errors='replace') for _ in paths]
+        self.budget, self.shown = budget, 0
+        self.newline = True
+
+    def poll(self):
+        for f, decoder in zip(self.files, self.decoders):
+            data = f.read()
+            if len(data) == 0 or self.shown > self.budget:
+                continue
+            data = data[:self.budget - self.shown + 1]
+            self.shown += len(data)
+            text = decoder.decode(data)
+            if self.shown > self.budget:
+                text += ('' if text.endswith('\n') else '\n') + '... [输出过长，其余内容不再显示]\n'
+            if text:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+                self.newline = text.endswith('\n')
+
+    def close(self):
+        self.poll()
+        if not self.newline:
+            print()
+        for f in self.files:
+            f.close()
+
+# 未指定执行器时使用的默认执行器，首次使用时创建
+default_executor:Executor = None
+
+def parse_and_exec(commands:list[dict], executor:Executor=None, live:bool=False, mode:str='deep'):
+    '''
+        解析并执行命令
+    '''
+    global default_executor
+    if executor is None:
+        if default_executor is None:
+            default_executor = Executor()
+        executor = default_executor
+    return executor.parse_and_exec(commands, live, mode)
 
 def parse_para(para:str):
     '''
@@ -152,6 +677,8 @@ def image(args:list[str]) -> str:
         os.environ['all_proxy'] = ''
         os.environ['http_proxy'] = ''
         os.environ['https_proxy'] = ''
+        # openai 导入较慢，只在使用 @image / @screen 时导入
+        from openai import OpenAI
         client = OpenAI(
             api_key="Ollama",
             base_url="http://localhost:11434/v1/"
@@ -181,7 +708,8 @@ def image(args:list[str]) -> str:
             content = chunk.choices[0].delta.content
             res += content
             print(f'\r  {" "*100}', end='')
-            print(f'\r {res[-50:].replace("\n", " ")}', end='', flush=True)
+            tail = res[-50:].replace('\n', ' ')
+            print(f'\r {tail}', end='', flush=True)
         print(f'\r  {" "*100}', end='')
         print(f'\r生成完成，共 {len(res)} 字，耗时 {time.time()-start:.2f} 秒。', flush=True)
         return res
@@ -0,0 +1,76 @@
+import json
+import time
+from collections import Counter
+
+from telemetry import Meter
+
+class Governor:
+    '''
+        深度对话的预算与循环检测
+        options: {
+            "rounds": 最大轮次,
+            "tokens": token 预算（接口未返回用量时按输出 token 估计），为空时不限制,
+            "time"  : 用时预算（秒），为空时不限制,
+            "repeat": 相同的工具调用或相同的错误输出出现多少次时视为陷入循环,
+            "action": 陷入循环时的处理：intervene 先提醒模型、再次出现时停止，stop 直接停止
+        }
+    '''
+    def __init__(self, options:dict=None):
+        self.options = {"rounds": 20, "tokens": None, "time": None, "repeat": 3, "action": "intervene"}
+        self.options.update(options or {})
+        self.start = time.time()
+        self.rounds, self.tokens = 0, 0
+        self.calls, self.errors = Counter(), Counter()
+        self.warned = set()
+
+    @staticmethod
+    def _used(meter:Meter) -> int:
+        if meter.usage is not None and meter.usage['total'] is not None:
+            return meter.usage['total']
+        return meter._tokens(True) + meter._tokens(False)
+
+    def _loop(self, commands:list[dict]) -> tuple[str, int]:
+        '''
+            记录本轮的工具调用与错误输出，返回出现次数最多的 (循环类型, 次数)
+        '''
+        call = json.dumps([(c['name'], c['code']) for c in commands], ensure_ascii=False)
+        self.calls[call] += 1
+        found = ('call', call, self.calls[call])
+        for c in commands:
+            if c.get('exitcode', 0) != 0 and c.get('stderr', '').strip():
+                error = (c['name'], c['stderr'].strip())
+                self.errors[error] += 1
+                if self.errors[error] > found[2]:
+                    found = ('error', error, self.errors[error])
+        return found
+
+    def step(self, meter:Meter, commands:list[dict]) -> tuple[str, str]:
+        '''
+            记录一轮对话，返回 (continue | intervene | stop, 说明)
+        '''
+        self.rounds += 1
+        self.tokens += self._used(meter)
+        opt = self.options
+        if self.rounds >= opt['rounds']:
+            return 'stop', f"已达到轮次上限（{opt['rounds']} 轮）"
+        if opt['tokens'] and self.tokens >= opt['tokens']:
+            return 'stop', f"已达到 token 预算（{opt['tokens']}）"
+        if opt['time'] and time.time() - self.start >= opt['time']:
+            return 'stop', f"已达到用时预算（{opt['time']}s）"
+        if len(commands) == 0:
+            return 'continue', ''
+        kind, key, count = self._loop(commands)
+        if count < opt['repeat']:
+            return 'continue', ''
+        what = '执行了相同的工具调用' if kind == 'call' else '得到了相同的错误输出'
+        if opt['action'] == 'stop' or key in self.warned:
+            return 'stop', f"检测到循环：{count} 次{what}"
+        self.warned.add(key)
+        return 'intervene', f"[governor] 你已经 {count} 次{what}。不要重复同样的尝试：" \
+            "请先分析原因并换一种方法；如果无法解决，请向用户说明情况并结束。"
+
+    def summary(self) -> str:
+        rounds = f"{self.rounds}/{self.options['rounds']} 轮"
+        tokens = f"{self.tokens} tokens" + (f"/{self.options['tokens']}" if self.options['tokens'] else '')
+        used = f"用时 {time.time() - self.start:.1f}s" + (f"/{self.options['time']}s" if self.options['time'] else '')
+        return ' · '.join([rounds, tokens, used])
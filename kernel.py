@@ -0,0 +1,282 @@
+'''
+    常驻的 Python 执行内核
+
+    父进程与内核进程之间通过一对管道，以「4 字节长度 + JSON」的帧格式通信；
+    内核在执行代码时将 fd 1/2 重定向到父进程指定的文件，因此子进程的输出同样会被捕获。
+    内核在多次调用之间保留全局变量，并可预加载常用模块。
+
+    资源限制：地址空间上限（RLIMIT_AS）在内核启动后设置，对整个内核生效；
+    CPU 时间上限按每次执行设置。RLIMIT_CPU 计算的是进程累计的 CPU 时间，因此执行前将软限制设为
+    已用时间加上限，超出时内核收到 SIGXCPU 并中断本次执行（退出码 128 + SIGXCPU），内核本身不退出。
+'''
+import os
+import sys
+import json
+import math
+import time
+import struct
+import signal
+import resource
+import threading
+import traceback
+import subprocess
+
+def _send(f, msg:dict):
+    data = json.dumps(msg, ensure_ascii=False).encode('utf-8')
+    f.write(struct.pack('>I', len(data)) + data)
+    f.flush()
+
+def _recv(f):
+    head = f.read(4)
+    if len(head) < 4:
+        return None
+    size, = struct.unpack('>I', head)
+    return json.loads(f.read(size).decode('utf-8'))
+
+def _print_exc():
+    '''
+        打印异常，略去内核自身的栈帧
+    '''
+    etype, value, tb = sys.exc_info()
+    traceback.print_exception(etype, value, tb.tb_next)
+
+class CPULimit(BaseException):
+    '''
+        本次执行超出 CPU 时间上限
+    '''
+
+def _on_xcpu(signum, frame):
+    raise CPULimit(f"CPU time limit exceeded ({signum})")
+
+def _set_cpu(seconds:float=None):
+    '''
+        设置本次执行的 CPU 时间上限（软限制），为空时取消
+    '''
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = hard
+    if seconds is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _exec(msg:dict, env:dict) -> int:
+    '''
+        在内核中执行代码，输出写入指定的文件，返回退出码
+    '''
+    try:
+        os.chdir(msg['cwd'])
+    except OSError:
+        pass
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    out = os.open(msg['stdout'], os.O_WRONLY | os.O_APPEND)
+    err = os.open(msg['stderr'], os.O_WRONLY | os.O_APPEND)
+    os.dup2(out, 1)
+    os.dup2(err, 2)
+    code = 0
+    try:
+        if msg.get('cpu'):
+            _set_cpu(msg['cpu'])
+        exec(compile(msg['code'], '<python>', 'exec'), env)
+    except CPULimit:
+        _print_exc()
+        code = 128 + signal.SIGXCPU
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except KeyboardInterrupt:
+        _print_exc()
+        code = 130
+    except MemoryError:
+        _print_exc()
+        code = 137
+    except BaseException:
+        _print_exc()
+        code = 1
+    finally:
+        if msg.get('cpu'):
+            _set_cpu()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in [out, err, *saved]:
+            os.close(fd)
+    return code
+
+def worker(rfd:int, wfd:int):
+    '''
+        内核进程的主循环
+    '''
+    rf, wf = os.fdopen(rfd, 'rb'), os.fdopen(wfd, 'wb')
+    env = {"__name__": "__main__"}
+    signal.signal(signal.SIGXCPU, _on_xcpu)
+    while True:
+        try:
+            msg = _recv(rf)
+        except KeyboardInterrupt:
+            continue
+        if msg is None:
+            break
+        if msg['op'] == 'init':
+            errors = []
+            for module in msg.get('preload', []):
+                try:
+                    exec(f"import {module}", env)
+                except Exception as e:
+                    errors.append(f"{module}: {e}")
+            _send(wf, {"ok": True, "errors": errors})
+        elif msg['op'] == 'exec':
+            try:
+                code = _exec(msg, env)
+            except CPULimit:
+                # 执行结束与取消限制之间收到的 SIGXCPU
+                code = 128 + signal.SIGXCPU
+            _send(wf, {"exitcode": code})
+        elif msg['op'] == 'reset':
+            env.clear()
+            env['__name__'] = '__main__'
+            _send(wf, {"ok": True})
+
+class Kernel:
+    '''
+        常驻 Python 内核的父进程端
+        preload: 预加载的模块，如 ["numpy as np", "pandas as pd"]
+        memory : 内核进程的地址空间上限（MB），为空时不限制；CPU 时间上限在每次执行时指定
+    '''
+    def __init__(self, preload:list[str]=None, memory:int=None, python:str='python3'):
+        self.preload, self.memory, self.python = preload or [], memory, python
+        self.proc, self.rfile, self.wfile = None, None, None
+        self.lock = threading.Lock()
+        self.started, self.count, self.errors = None, 0, []
+        self.pending_init = False
+
+    def start(self):
+        '''
+            启动内核并异步发起预加载，首次执行时再等待预加载完成
+        '''
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        self.proc = subprocess.Popen(
+            [self.python, '-u', os.path.abspath(__file__), '--worker', str(r1), str(w2)],
+            pass_fds=(r1, w2), stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        if self.memory is not None:
+            # 启动后再设置限制，避免在工作线程中使用 preexec_fn
+            size = int(self.memory) * 1024 * 1024
+            try:
+                resource.prlimit(self.proc.pid, resource.RLIMIT_AS, (size, size))
+            except ProcessLookupError:
+                pass
+        os.close(r1)
+        os.close(w2)
+        self.wfile, self.rfile = os.fdopen(w1, 'wb'), os.fdopen(r2, 'rb')
+        self.started, self.count = time.time(), 0
+        _send(self.wfile, {"op": "init", "preload": self.preload})
+        self.pending_init = True
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _request(self, msg:dict) -> dict:
+        if not self.alive():
+            self.start()
+        if self.pending_init:
+            init = _recv(self.rfile)
+            self.errors = [] if init is None else init.get('errors', [])
+            self.pending_init = False
+        _send(self.wfile, msg)
+        res = _recv(self.rfile)
+        if res is None:
+            raise RuntimeError(f"Kernel exited with code {self.proc.wait()}.")
+        return res
+
+    def run(self, code:str, stdout:str, stderr:str, cwd:str=None, cpu:float=None) -> int:
+        '''
+            执行代码，输出追加到 stdout/stderr 文件，返回退出码；
+            cpu 为本次执行的 CPU 时间上限（秒）；Ctrl-C 会中断内核中正在执行的代码
+        '''
+        with self.lock:
+            try:
+                res = self._request({
+                    "op": "exec", "code": code, "cwd": cwd or os.getcwd(),
+                    "stdout": stdout, "stderr": stderr, "cpu": cpu
+                })
+            except (RuntimeError, BrokenPipeError, OSError) as e:
+                # 内核崩溃（如超出内存上限被杀死），下次调用时重新启动
+                with open(stderr, 'a', encoding='utf-8') as f:
+                    f.write(f"{e}\nThe kernel has been reset, globals are lost.\n")
+                self.close()
+                return 137
+            except KeyboardInterrupt:
+                self.interrupt()
+                _recv(self.rfile)
+                raise
+            self.count += 1
+            return res['exitcode']
+
+    def interrupt(self):
+        '''
+            中断正在执行的代码
+        '''
+        if self.alive():
+            os.kill(self.proc.pid, signal.SIGINT)
+
+    def kill(self):
+        '''
+            强制结束内核及其子进程，正在等待的调用随即返回，下次调用时重新启动
+        '''
+        if self.alive():
+            os.killpg(self.proc.pid, signal.SIGKILL)
+
+    def reset(self):
+        '''
+            清空内核中的全局变量
+        '''
+        with self.lock:
+            self._request({"op": "reset"})
+
+    def restart(self):
+        with self.lock:
+            self.close()
+            self.start()
+
+    def close(self):
+        if self.proc is not None:
+            for f in [self.wfile, self.rfile]:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+        self.pending_init = False
+
+    def status(self) -> dict:
+        '''
+            内核状态：进程号、运行时长、执行次数与常驻内存
+        '''
+        if not self.alive():
+            return {"alive": False}
+        rss = None
+        try:
+            with open(f"/proc/{self.proc.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss = int(line.split()[1]) // 1024
+        except OSError:
+            pass
+        return {"alive": True, "pid": self.proc.pid, "uptime": time.time() - self.started,
+                "count": self.count, "rss": rss, "errors": self.errors}
+
+if __name__ == "__main__" and len(sys.argv) == 4 and sys.argv[1] == '--worker':
+    worker(int(sys.argv[2]), int(sys.argv[3]))
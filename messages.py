@@ -0,0 +1,170 @@
+'''
+    内存紧凑的消息记录
+
+    历史记录中的消息在每轮结束后转换为 Message：使用 __slots__ 存储字段，角色、模型名等短字符串驻留（intern）；
+    较长的思考过程与工具输出写入磁盘，只保留文件引用，在回放、归档或发送请求需要时再读取。
+    Message 实现了 MutableMapping，读写方式与原来的字典相同；序列化时使用 json.dumps(..., default=dict)。
+'''
+import os
+import sys
+import shutil
+import hashlib
+from pathlib import Path
+from collections.abc import MutableMapping
+
+# 缺失字段的占位
+_MISSING = object()
+
+class Blob:
+    '''
+        存储在磁盘上的文本
+    '''
+    __slots__ = ('path', 'size')
+
+    def __init__(self, path:Path, size:int):
+        self.path, self.size = path, size
+
+    def read(self) -> str:
+        try:
+            with open(self.path, encoding="utf-8", errors="surrogatepass") as f:
+                return f.read()
+        except OSError:
+            return f"[内容已丢失：{self.path}]"
+
+class Message(MutableMapping):
+    '''
+        一条消息，字段与 OpenAI 消息格式相同，另有 reasoning（思考过程）与 metadata（本地信息）
+    '''
+    FIELDS = ('role', 'content', 'name', 'tool_calls', 'tool_call_id', 'reasoning', 'metadata')
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, data:dict=None):
+        for field in self.FIELDS:
+            object.__setattr__(self, field, _MISSING)
+        self.extra = None
+        for k, v in (data or {}).items():
+            self[k] = v
+
+    def _raw(self, key:str):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return _MISSING if self.extra is None else self.extra.get(key, _MISSING)
+
+    def __getitem__(self, key:str):
+        value = self._raw(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value.read() if isinstance(value, Blob) else value
+
+    def __setitem__(self, key:str, value):
+        if key in self.FIELDS:
+            object.__setattr__(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key:str):
+        if self._raw(key) is _MISSING:
+            raise KeyError(key)
+        if key in self.FIELDS:
+            object.__setattr__(self, key, _MISSING)
+        else:
+            del self.extra[key]
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self._raw(key) is not _MISSING
+
+    def __repr__(self) -> str:
+        return f"Message({dict(self)!r})"
+
+    def payload(self) -> dict:
+        '''
+            发送请求时使用的字典：不包含思考过程，避免从磁盘读取
+        '''
+        return {k: self[k] for k in self if k != 'reasoning'}
+
+def payload(messages:list) -> list[dict]:
+    '''
+        转换为请求使用的消息列表（思考过程不会发送给模型）
+    '''
+    return [m.payload() if isinstance(m, Message) else {k: v for k, v in m.items() if k != 'reasoning'}
+            for m in messages]
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) and len(value) <= 64 else value
+
+class MessageStore:
+    '''
+        将历史记录中的消息转换为 Message，较长的思考过程与工具输出写入 directory/<pid>/<hash>
+        options: {
+            "spill": 超过多少字符的思考过程与工具输出写入磁盘，为 0 时不写入
+        }
+    '''
+    def __init__(self, directory:Path, options:dict=None):
+        self.options = {"spill": 4096}
+        self.options.update(options or {})
+        self.root = Path(directory)
+        self.directory = self.root / str(os.getpid())
+        self._clean()
+
+    def _clean(self):
+        '''
+            删除已退出的进程留下的目录
+        '''
+        if not self.root.exists():
+            return
+        for path in self.root.iterdir():
+            if not path.name.isdigit() or int(path.name) == os.getpid():
+                continue
+            try:
+                os.kill(int(path.name), 0)
+            except ProcessLookupError:
+                shutil.rmtree(path, ignore_errors=True)
+            except PermissionError:
+                continue
+
+    def _spill(self, text:str):
+        limit = self.options['spill']
+        if not isinstance(text, str) or not limit or len(text) < limit:
+            return text
+        data = text.encode('utf-8', 'surrogatepass')
+        path = self.directory / hashlib.sha256(data).hexdigest()[:24]
+        if not path.exists():
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        return Blob(path, len(text))
+
+    def compact(self, history:dict[str, list]):
+        '''
+            将历史记录中尚未转换的消息替换为 Message（已转换的消息跳过）
+        '''
+        messages = history['history']
+        for i, m in enumerate(messages):
+            if isinstance(m, Message):
+                continue
+            record = Message()
+            for k, v in m.items():
+                record[sys.intern(k)] = v
+            record.role = sys.intern(m['role'])
+            if isinstance(m.get('metadata'), dict):
+                record.metadata = {sys.intern(k): _intern(v) for k, v in m['metadata'].items()}
+            if 'reasoning' in m:
+                record.reasoning = self._spill(m['reasoning'])
+            if m['role'] == 'tool' or (m['role'] == 'user' and m.get('metadata', {}).get('run', False)):
+                record.content = self._spill(m['content'])
+            messages[i] = record
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
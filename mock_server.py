@@ -0,0 +1,228 @@
+#!/bin/env python
+'''
+    本地 OpenAI 兼容的流式模拟服务，用于离线测试与性能测量
+
+    支持可配置的首字延迟、输出速度、抖动、思考内容风格（reasoning_content / <think>）、
+    故障注入，以及回放从真实会话录制的 cassette。
+
+    用法：python mock_server.py --port 8765 --ttft 0.5 --tps 40 --style attr
+    然后将配置中的 base_url 设为 http://127.0.0.1:8765/v1
+'''
+import json
+import time
+import random
+import argparse
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from cassette import cassette_key
+
+WORDS = (
+    "这是 一段 用于 测试 的 模拟 回复 ， 它 会 按照 设定 的 速度 逐词 输出 。 "
+    "The quick brown fox jumps over the lazy dog . "
+    "流式 渲染 需要 处理 代码块 、 列表 与 标题 等 Markdown 元素 。"
+).split()
+
+class Cassettes:
+    '''
+        cassette 库：优先按最后一条消息匹配，否则按顺序循环回放
+    '''
+    def __init__(self, directory:Path):
+        self.items, self.index, self.lock = [], 0, threading.Lock()
+        for path in sorted(Path(directory).glob('*.jsonl')):
+            with open(path, encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            if len(lines) > 0:
+                self.items.append((lines[0], lines[1:]))
+
+    def pick(self, messages:list[dict]):
+        if len(self.items) == 0:
+            return None
+        key = cassette_key(messages)
+        for header, chunks in self.items:
+            if header.get('key') == key:
+                return chunks
+        with self.lock:
+            _, chunks = self.items[self.index % len(self.items)]
+            self.index += 1
+        return chunks
+
+class MockHandler(BaseHTTPRequestHandler):
+    options:argparse.Namespace = None
+    cassettes:Cassettes = None
+
+    def log_message(self, format, *args):
+        if not self.options.quiet:
+            super().log_message(format, *args)
+
+    def _json(self, code:int, body:dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sse(self, data):
+        self.wfile.write(b'data: ' + (data if isinstance(data, bytes) else
+                         json.dumps(data, ensure_ascii=False).encode('utf-8')) + b'\n\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._json(200, {"object": "list", "data": [
+                {"id": m, "object": "model", "owned_by": "mock"} for m in self.options.models
+            ]})
+        else:
+            self._json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._json(404, {"error": {"message": "Not found"}})
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        opt = self.options
+
+        failure = None
+        if random.random() < opt.fail_rate:
+            failure = random.choice(opt.fail_modes)
+        if failure in ['500', '429', '503']:
+            return self._json(int(failure), {"error": {"message": f"Injected failure {failure}"}})
+
+        messages = body.get('messages', [])
+        model = body.get('model', 'mock')
+        if not body.get('stream', False):
+            text = ''.join(t for _, t in self._script(messages))
+            return self._json(200, {
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}]
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            chunks = None if self.cassettes is None else self.cassettes.pick(messages)
+            if chunks is not None:
+                self._replay(chunks)
+            else:
+                self._generate(model, messages, body, failure)
+            self._sse(b'[DONE]')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _replay(self, chunks:list[dict]):
+        for item in chunks:
+            time.sleep(item.get('dt', 0) / self.options.speed)
+            self._sse(item['data'])
+
+    def _script(self, messages:list[dict]):
+        '''
+            生成 (是否为思考内容, 文本) 序列
+        '''
+        opt = self.options
+        rng = random.Random(cassette_key(messages))
+        for _ in range(opt.reasoning):
+            yield True, rng.choice(WORDS) + ' '
+        last = messages[-1] if len(messages) > 0 else {}
+        system = messages[0].get('content', '') if len(messages) > 0 else ''
+        if opt.tools and '```json' in str(system) and not last.get('metadata', {}).get('run', False):
+            # 深度对话：先调用一次工具，收到运行结果后再正常回答
+            call = json.dumps([{"name": "bash", "code": "echo mock"}])
+            for piece in ['```json\n', call, '\n```']:
+                yield False, piece
+            return
+        for _ in range(opt.tokens):
+            yield False, rng.choice(WORDS) + ' '
+
+    def _generate(self, model:str, messages:list[dict], body:dict, failure:str):
+        opt = self.options
+        created, count = int(time.time()), 0
+        def chunk(delta:dict):
+            return {"id": "mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+
+        self._sse(chunk({"role": "assistant", "content": ""}))
+        time.sleep(opt.stall if failure == 'stall' else opt.ttft)
+        last = messages[-1] if len(messages) > 0 else {}
+        if opt.tools and body.get('tools') and last.get('role') != 'tool':
+            # 原生工具调用：以 tool_calls 增量发起一次调用
+            arguments = json.dumps({"code": "echo mock"})
+            self._sse(chunk({"tool_calls": [{"index": 0, "id": "call_mock", "type": "function",
+                                             "function": {"name": "bash", "arguments": ""}}]}))
+            for i in range(0, len(arguments), 4):
+                self._sse(chunk({"tool_calls": [{"index": 0, "function": {"arguments": arguments[i:i+4]}}]}))
+            end = chunk({})
+            end['choices'][0]['finish_reason'] = 'tool_calls'
+            self._sse(end)
+            return
+        script = list(self._script(messages))
+        if opt.style == 'tag' and any(r for r, _ in script):
+            # <think> 风格：思考内容包裹在标签中，作为普通内容输出
+            thinking = [(False, t) for r, t in script if r]
+            script = [(False, '<think>')] + thinking + [(False, '</think>')] + [(r, t) for r, t in script if not r]
+        for i, (reasoning, text) in enumerate(script):
+            if failure == 'drop' and i >= len(script) // 2:
+                # 模拟连接中途断开
+                self.wfile.flush()
+                self.connection.close()
+                return
+            if i > 0 and opt.tps > 0:
+                time.sleep(max(0.0, random.gauss(1 / opt.tps, opt.jitter / opt.tps)))
+            if reasoning and opt.style == 'attr':
+                self._sse(chunk({"content": None, "reasoning_content": text}))
+            else:
+                self._sse(chunk({"content": text}))
+            count += 1
+        last = chunk({})
+        last['choices'][0]['finish_reason'] = 'stop'
+        self._sse(last)
+        if body.get('stream_options', {}).get('include_usage'):
+            prompt = sum(len(str(m.get('content', ''))) for m in messages) // 2
+            self._sse({"id": "mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [], "usage": {"prompt_tokens": prompt, "completion_tokens": count,
+                                                "total_tokens": prompt + count}})
+
+def serve(options:argparse.Namespace):
+    # 每个服务使用独立的处理类，同一进程中的多个服务互不影响
+    handler = type('MockHandler', (MockHandler,), {
+        "options": options,
+        "cassettes": None if options.cassettes is None else Cassettes(options.cassettes)
+    })
+    server = ThreadingHTTPServer((options.host, options.port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible streaming server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--models", type=lambda s: s.split(','), default=["mock"], help="Comma separated model ids.")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token.")
+    parser.add_argument("--tps", type=float, default=50, help="Tokens per second, 0 for no delay.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative std-dev of inter-token gaps.")
+    parser.add_argument("--tokens", type=int, default=120, help="Answer tokens per response.")
+    parser.add_argument("--reasoning", type=int, default=0, help="Reasoning tokens per response.")
+    parser.add_argument("--style", choices=['attr', 'tag'], default='attr',
+                        help="Reasoning as `reasoning_content` (attr) or inside <think> tags (tag).")
+    parser.add_argument("--tools", action='store_true', help="Answer deep-mode prompts with a tool call first.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probability of injecting a failure.")
+    parser.add_argument("--fail-modes", type=lambda s: s.split(','), default=['500'],
+                        help="Comma separated failures: 500, 429, 503, stall, drop.")
+    parser.add_argument("--stall", type=float, default=30, help="Seconds to stall before the first token.")
+    parser.add_argument("--cassettes", type=Path, help="Replay recorded cassettes (*.jsonl) from a directory.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Cassette replay speed factor.")
+    parser.add_argument("-q", "--quiet", action='store_true', help="Do not log requests.")
+    options = parser.parse_args()
+
+    server = serve(options)
+    print(f"Mock server listening on http://{options.host}:{options.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import time
+import queue
+import threading
+
+from _global import *
+
+from rich.panel import Panel
+from rich.layout import Layout
+from rich.markdown import Markdown
+
+def has_token(chunk) -> bool:
+    '''
+        判断数据块中是否包含有效输出（思考或回复）
+    '''
+    if not getattr(chunk, 'choices', None):
+        return False
+    delta = chunk.choices[0].delta
+    return bool(getattr(delta, 'reasoning_content', None) or getattr(delta, 'content', None))
+
+class Contender(threading.Thread):
+    '''
+        在后台线程中发起流式请求，并预取到首个有效数据块为止
+    '''
+    def __init__(self, create, model:str, board:queue.Queue):
+        super().__init__(daemon=True)
+        self.create, self.model, self.board = create, model, board
+        self.response, self.head = None, []
+        self.error, self.cancelled = None, False
+        self.start_time = time.time()
+        self.connect, self.ttft = None, None
+
+    def run(self):
+        try:
+            self.response = self.create()
+            self.connect = time.time() - self.start_time
+            token = False
+            for chunk in self.response:
+                self.head.append(chunk)
+                token = has_token(chunk)
+                if self.cancelled or token:
+                    break
+            # 被取消且未产出数据时首字延迟未知
+            if token or not self.cancelled:
+                self.ttft = time.time() - self.start_time
+        except Exception as e:
+            # 取消时关闭连接引发的异常不是请求本身的错误
+            if not self.cancelled:
+                self.error = e
+        if self.cancelled:
+            self.close()
+        self.board.put(self)
+
+    def stream(self):
+        '''
+            返回完整的数据流（包含已预取的数据块）
+        '''
+        yield from self.head
+        if self.response is not None:
+            yield from self.response
+
+    def close(self):
+        try:
+            if self.response is not None and hasattr(self.response, 'close'):
+                self.response.close()
+        except Exception:
+            pass
+
+    def cancel(self):
+        '''
+            取消请求；尚未建立连接的线程会在连接后自行关闭
+        '''
+        self.cancelled = True
+        self.close()
+
+    def report(self, status:str) -> dict:
+        return {
+            "model"  : self.model,
+            "status" : status,
+            "connect": None if self.connect is None else round(self.connect, 3),
+            "ttft"   : None if self.ttft is None else round(self.ttft, 3)
+        }
+
+def wait_first(board:queue.Queue, pending:list[Contender], timeout:float=None):
+    '''
+        等待首个产出有效数据的竞争者，超时返回 None；
+        所有竞争者均失败时抛出最后一个错误
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+    error = None
+    while len(pending) > 0:
+        try:
+            left = None if deadline is None else max(0, deadline - time.time())
+            item:Contender = board.get(timeout=left)
+        except queue.Empty:
+            return None
+        if item not in pending:
+            continue
+        pending.remove(item)
+        if item.error is None and not item.cancelled:
+            return item
+        error = item.error or error
+    if error is not None:
+        raise error
+    return None
+
+_END = object()
+
+def deadline_stream(stream, timeout:float=None, cancel=None):
+    '''
+        为数据流添加块间超时，超时后调用 cancel 并抛出 TimeoutError
+    '''
+    if timeout is None:
+        yield from stream
+        return
+    box, finished = queue.Queue(), False
+    def pump():
+        try:
+            for chunk in stream:
+                box.put((chunk, None))
+            box.put((_END, None))
+        except Exception as e:
+            box.put((_END, e))
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        while True:
+            try:
+                chunk, error = box.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No data received within {timeout}s.")
+            if chunk is _END:
+                finished = True
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        if not finished and cancel is not None:
+            cancel()
+
+class SideBySide:
+    '''
+        使用 Layout 将多个模型的回复并排显示
+    '''
+    def __init__(self, columns:list[dict], max_height:int=None):
+        self.columns = columns
+        self.max_height = max_height
+
+    def _panel(self, col:dict):
+        text = col['answer']
+        if col['reasoning'] and not col['answer']:
+            text = '> ' + col['reasoning'][-400:].replace('\n', '\n> ')
+        title = f"󱚣  {col['model']}"
+        subtitle = col.get('status', '')
+        return Panel(Markdown(text, code_theme="monokai", inline_code_lexer="text"),
+                     title=title, subtitle=subtitle, title_align='left', border_style="#5f87af")
+
+    def __rich_console__(self, console, options):
+        width = options.max_width // max(1, len(self.columns))
+        height = 3
+        for col in self.columns:
+            lines = console.render_lines(self._panel(col), options.update(width=width, height=None))
+            height = max(height, len(lines))
+        if self.max_height is not None:
+            height = min(height, self.max_height)
+        layout = Layout()
+        layout.split_row(*[
+            Layout(self._panel(col), name=str(i)) for i, col in enumerate(self.columns)
+        ])
+        yield from console.render(layout, options.update(height=height))
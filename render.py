@@ -41,6 +41,16 @@ custom_theme = Theme({
 })
 console = Console(theme=custom_theme)
 
+def extract_snippets(text:str) -> list[dict]:
+    '''
+        从完整的 Markdown 文本中提取代码片段
+    '''
+    md = Markdown(text)
+    return [
+        {"lang": elem.info, "code": elem.content}
+        for elem in md.parsed if elem.type == 'fence' and elem.block
+    ]
+
 class MDStreamRenderer:
     def __init__(self, code_start:int):
         self.md = None
@@ -0,0 +1,169 @@
+import time
+import threading
+from urllib.parse import urlparse
+
+class Endpoint:
+    '''
+        单个 OpenAI 兼容端点及其实时状态（EWMA 延迟、错误率与熔断状态）
+    '''
+    def __init__(self, base_url:str, api_key:str, model:str=None):
+        self.base_url, self.api_key = base_url, api_key
+        # 端点上实际使用的模型名，为空时沿用配置中的模型名
+        self.model = model
+        self.latency, self.error_rate = None, 0.0
+        self.failures, self.opened_at = 0, None
+        self.state = 'closed'
+        self._client = None
+        self.lock = threading.Lock()
+
+    @property
+    def client(self) -> "OpenAI":
+        if self._client is None:
+            # openai 导入较慢，在第一次请求时导入
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.base_url or '').netloc or str(self.base_url)
+
+    def available(self, cooldown:float) -> bool:
+        '''
+            熔断器是否允许请求，冷却结束后进入半开状态放行试探请求
+        '''
+        if self.state == 'open' and time.time() - self.opened_at >= cooldown:
+            self.state = 'half'
+        return self.state != 'open'
+
+    def score(self) -> float:
+        '''
+            评分越低越优先；未测量过的端点优先试探
+        '''
+        return (self.latency or 0.0) * (1 + 4 * self.error_rate)
+
+class Route:
+    '''
+        模型路由：配置中的模型名及其候选端点
+    '''
+    def __init__(self, router:'Router', name:str, endpoints:list[Endpoint]):
+        self.router, self.name, self.endpoints = router, name, endpoints
+
+    def ranked(self) -> list[Endpoint]:
+        '''
+            按熔断状态与评分排序的端点列表，熔断中的端点排在最后作为兜底
+        '''
+        cooldown = self.router.options['cooldown']
+        return sorted(self.endpoints, key=lambda ep: (not ep.available(cooldown), ep.score()))
+
+    def __str__(self):
+        return self.name
+
+class Router:
+    '''
+        按实时延迟与错误率在多个端点间选择，并进行健康检查与熔断
+    '''
+    def __init__(self, config:dict):
+        self.options = {
+            "alpha"          : 0.3,   # EWMA 平滑系数
+            "threshold"      : 3,     # 连续失败次数达到阈值后熔断
+            "cooldown"       : 30,    # 熔断冷却时间（秒）
+            "health_interval": 30     # 健康检查间隔（秒），0 表示关闭
+        }
+        self.options.update(config.get("router", {}))
+        self.api_key, self.base_url = config["api_key"], config["base_url"]
+        self.pool:dict[tuple, Endpoint] = {}
+        self.routes:dict[str, Route] = {}
+        # 保护 pool 与 routes：健康检查线程与主线程并发访问
+        self.lock = threading.Lock()
+        # 健康检查中出现的异常，供 /route 显示
+        self.errors:list[str] = []
+        for model in config.get("models", []):
+            endpoints = [
+                self.endpoint(ep.get('base_url'), ep.get('api_key'), ep.get('model'))
+                for ep in model.get('endpoints', [])
+            ] or [self.endpoint()]
+            self.routes[model['model']] = Route(self, model['model'], endpoints)
+        self.health = None
+        if self.options['health_interval'] and any(len(r.endpoints) > 1 for r in self.routes.values()):
+            self.health = threading.Thread(target=self._health_loop, daemon=True)
+            self.health.start()
+
+    def endpoint(self, base_url:str=None, api_key:str=None, model:str=None) -> Endpoint:
+        '''
+            获取（并复用）端点，缺省字段使用全局配置
+        '''
+        key = (base_url or self.base_url, api_key or self.api_key, model)
+        with self.lock:
+            if key not in self.pool:
+                self.pool[key] = Endpoint(*key)
+            return self.pool[key]
+
+    def route(self, model:str) -> Route:
+        '''
+            获取模型的路由，未配置的模型使用全局端点
+        '''
+        endpoint = self.endpoint()
+        with self.lock:
+            if model not in self.routes:
+                self.routes[model] = Route(self, model, [endpoint])
+            return self.routes[model]
+
+    def snapshot(self) -> list[Route]:
+        '''
+            当前所有路由的副本，可在其他线程修改路由时安全遍历
+        '''
+        with self.lock:
+            return list(self.routes.values())
+
+    def report(self, endpoint:Endpoint, latency:float=None, error:bool=False):
+        '''
+            反馈一次请求的结果（首字延迟或失败）
+        '''
+        if endpoint is None:
+            return
+        alpha = self.options['alpha']
+        with endpoint.lock:
+            endpoint.error_rate = (1 - alpha) * endpoint.error_rate + alpha * (1.0 if error else 0.0)
+            if latency is not None:
+                endpoint.latency = latency if endpoint.latency is None else \
+                    (1 - alpha) * endpoint.latency + alpha * latency
+            if error:
+                endpoint.failures += 1
+                if endpoint.state == 'half' or endpoint.failures >= self.options['threshold']:
+                    endpoint.state, endpoint.opened_at = 'open', time.time()
+            else:
+                endpoint.failures, endpoint.state = 0, 'closed'
+
+    def penalize(self, endpoint:Endpoint, waited:float):
+        '''
+            反馈未产出首字即被取消的请求：已等待的时长作为延迟的下界，不影响错误率与熔断状态
+        '''
+        if endpoint is None:
+            return
+        alpha = self.options['alpha']
+        with endpoint.lock:
+            if endpoint.latency is None:
+                endpoint.latency = waited
+            elif waited > endpoint.latency:
+                endpoint.latency = (1 - alpha) * endpoint.latency + alpha * waited
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.options['health_interval'])
+            try:
+                self._probe()
+            except Exception as e:
+                # 记录后继续，避免健康检查线程退出后熔断的端点不再被试探
+                self.errors = (self.errors + [f"{time.strftime('%H:%M:%S')} {type(e).__name__}: {e}"])[-5:]
+
+    def _probe(self):
+        endpoints = {ep for r in self.snapshot() if len(r.endpoints) > 1 for ep in r.endpoints}
+        for ep in endpoints:
+            try:
+                ep.client.with_options(timeout=5, max_retries=0).models.list()
+                with ep.lock:
+                    if ep.state == 'open':
+                        ep.state = 'half'
+            except Exception:
+                self.report(ep, error=True)
@@ -0,0 +1,191 @@
+'''
+    深度对话的构建与执行，以及多任务并行执行（ag run-tasks）
+
+    每个任务在独立的进程中运行，拥有独立的工作目录、历史记录文件与工具执行器；
+    所有任务共享一个跨进程的信号量，限制同时进行的模型请求数。
+'''
+import os
+import re
+import sys
+import json
+import time
+import traceback
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from _global import *
+from chat import Chat
+from deep import Deep
+from router import Router
+from governor import Governor
+from execute import Executor
+
+def build(config:dict, gate=None, executor:Executor=None) -> tuple[Router, Executor, Chat, Deep]:
+    '''
+        根据配置构建路由、执行器与对话对象，可传入已创建的执行器
+    '''
+    router = Router(config)
+    executor = executor or Executor(config.get("exec"))
+    common = (config["api_key"], config["base_url"], config.get("timeout"), config.get("hedge"),
+              config.get("stream_usage", True), router, config.get("record", False))
+    chat = Chat(*common)
+    deep = Deep(*common,
+                early_tool=config.get("early_tool", "cancel"),
+                tools=config.get("deep_tools", "fence"),
+                prompts={"fence": config["deep_prompt"], "native": config.get("tool_prompt")},
+                executor=executor, gate=gate)
+    return router, executor, chat, deep
+
+def deep_loop(deep:Deep, governor:Governor, user:str, msg:str, history:dict[str, list], model:str,
+              after=None) -> tuple[str, str]:
+    '''
+        循环执行深度对话，直到模型给出最终回答或被预算停止；
+        after 在每轮结束后调用。返回 (finish | stopped, 说明)
+    '''
+    while True:
+        status, cmd, _ = deep.chat(user=user, msg=msg, history=history, model=model, run=governor.rounds > 0)
+        if after is not None:
+            after()
+        action, reason = governor.step(deep.last['meter'], deep.last['commands'])
+        if status != 'exec':
+            return 'finish', ''
+        if action == 'stop':
+            print("╭─  󰔟  任务已停止")
+            print(f"╰─  {reason}")
+            return 'stopped', reason
+        # 提醒附加在工具结果之后（原生工具调用模式下作为单独的消息）
+        msg = cmd if action == 'continue' else (reason if cmd is None else cmd + '\n\n' + reason)
+
+def load_tasks(path:Path) -> list[dict]:
+    '''
+        读取任务文件，每行一个任务：
+        {"id": 任务名, "prompt": 任务内容, "cwd": 工作目录, "model": 模型, "governor": 预算, "config": 其他配置}
+        除 prompt 外均可省略
+    '''
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            task = json.loads(line)
+            task['id'] = str(task.get('id', len(tasks)))
+            tasks.append(task)
+    return tasks
+
+def check_ids(tasks:list[dict]) -> list[str]:
+    '''
+        检查任务 id：id 用作任务目录名，只能包含字母、数字、下划线、点与连字符，
+        不能为 . 或 ..，且不能重复（包括与缺省的序号 id 重复）。返回错误信息
+    '''
+    errors, seen = [], {}
+    for i, task in enumerate(tasks):
+        tid = task['id']
+        if not re.fullmatch(r"[\w.-]+", tid) or tid in ['.', '..']:
+            errors.append(f"第 {i + 1} 个任务的 id 无效：{tid!r}")
+        elif tid in seen:
+            errors.append(f"第 {i + 1} 个任务的 id {tid!r} 与第 {seen[tid] + 1} 个任务重复")
+        else:
+            seen[tid] = i
+    return errors
+
+# 工作进程中共享的请求信号量
+_gate = None
+
+def _init(gate):
+    global _gate
+    _gate = gate
+
+def _run(task:dict, config:dict, run_dir:Path) -> dict:
+    '''
+        在工作进程中执行单个任务，输出写入任务目录下的 output.log
+    '''
+    directory = run_dir / task['id']
+    os.makedirs(directory, exist_ok=True)
+    cwd = Path(task['cwd']).expanduser() if task.get('cwd') else directory / 'work'
+    os.makedirs(cwd, exist_ok=True)
+    os.chdir(cwd)
+    stdout, stdin = sys.stdout, os.dup(0)
+    log = open(directory / 'output.log', 'w', encoding='utf-8', buffering=1)
+    sys.stdout = sys.stderr = log
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.close(null)
+
+    config = config | task.get('config', {})
+    model = task.get('model', config['model'])
+    history = {"history": [{"role": "system", "content": config['deep_prompt']}], "snippet": []}
+    governor = Governor((config.get("governor") or {}) | task.get('governor', {}))
+    result = {"id": task['id'], "cwd": str(cwd), "model": model}
+    executor = None
+    try:
+        _, executor, _, deep = build(config, _gate)
+        print(f'\n╭─  󰧑 task {task["id"]}')
+        print(f'╰─  {task["prompt"]}')
+        status, reason = deep_loop(deep, governor, 'task', task['prompt'], history, model)
+        error = deep.last['meter'].error if deep.last['meter'] is not None else None
+        result |= {"status": 'error' if error else status, "reason": reason or error}
+    except Exception:
+        result |= {"status": 'error', "reason": traceback.format_exc()}
+    finally:
+        if executor is not None:
+            executor.close()
+        with open(directory / 'history.json', 'w', encoding='utf-8') as f:
+            json.dump(history, f, indent=2, ensure_ascii=False)
+        sys.stdout = sys.stderr = stdout
+        log.close()
+        os.dup2(stdin, 0)
+        os.close(stdin)
+    answers = [m for m in history['history'] if m['role'] == 'assistant' and m.get('content')]
+    result |= {
+        "rounds": governor.rounds, "tokens": governor.tokens,
+        "time": round(time.time() - governor.start, 3),
+        "answer": answers[-1]['content'] if len(answers) > 0 else None,
+        "history": str(directory / 'history.json'), "log": str(directory / 'output.log')
+    }
+    return result
+
+def run_tasks(config:dict, path:Path, jobs:int=4, requests:int=None, output:Path=None):
+    '''
+        并行执行任务文件中的任务，结果逐行追加写入 JSONL
+    '''
+    tasks = load_tasks(path)
+    errors = check_ids(tasks)
+    if len(errors) > 0:
+        print("╭─    任务 id 无效，未执行任何任务")
+        for error in errors:
+            print(f"├─  {error}")
+        print("╰─  id 用作任务目录名，只能包含字母、数字、下划线、点与连字符，且不能重复")
+        return
+    run_dir = TASKS_DIR / time.strftime(HISTORY_FORMAT, time.localtime())
+    os.makedirs(run_dir, exist_ok=True)
+    output = Path(output) if output is not None else run_dir / 'results.jsonl'
+    requests = requests or jobs
+    print(f"╭─  󰐊  并行任务：{len(tasks)} 个，并发 {jobs}，模型请求并发 {requests}")
+    print(f"├─  任务目录：{run_dir}")
+    # spawn 启动的工作进程不会继承父进程中的线程与连接
+    context = multiprocessing.get_context('spawn')
+    gate = context.BoundedSemaphore(requests)
+    counts, start = {}, time.time()
+    with open(output, 'a', encoding='utf-8') as f, \
+         ProcessPoolExecutor(jobs, mp_context=context, initializer=_init, initargs=(gate,)) as pool:
+        futures = {pool.submit(_run, task, config, run_dir): task for task in tasks}
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"id": futures[future]['id'], "status": 'error', "reason": str(e)}
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+                f.flush()
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                icon = {'finish': '', 'stopped': '󰔟', 'error': ''}.get(result['status'], '')
+                stats = f"{result['rounds']} 轮，{result['tokens']} tokens，{result['time']:.1f}s" \
+                    if 'rounds' in result else result['reason']
+                print(f"├─  {icon} {result['id']}: {result['status']}（{stats}）", flush=True)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("╰─  󰈆  已中断，未开始的任务已取消")
+            return
+    summary = '，'.join(f"{k} {v} 个" for k, v in counts.items())
+    print(f"╰─  完成：{summary}，共 {time.time() - start:.1f}s，结果：{output}")
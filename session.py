@@ -0,0 +1,201 @@
+import os
+import json
+import time
+from pathlib import Path
+
+from archive import read as read_archive
+
+class SessionLog:
+    '''
+        追加写入的会话日志（JSONL），每条消息或代码片段一行，写入开销与会话长度无关
+        记录类型：
+            meta   : 日志头，记录归档路径（继续已归档的会话时）；记录 base 时，前 base 条消息与代码片段从归档读取
+            system : 系统提示的变化
+            message: 一条消息
+            snippet: 一个代码片段
+            reset  : 清空历史（之后的记录重新开始）
+        每次同步后 flush，至多每 interval 秒 fsync 一次；进程崩溃后可从日志恢复会话
+        文件名：path 为基准路径，每个进程写入各自的 <stem>.<pid><suffix>，
+        退出时改名保留的日志为 <stem>.<pid>.<时间><suffix>；只恢复所属进程已退出的日志
+    '''
+    def __init__(self, path:Path, interval:float=1.0):
+        self.base, self.interval = Path(path), interval
+        self.path = self.base.with_name(f"{self.base.stem}.{os.getpid()}{self.base.suffix}")
+        self.file = None
+        self.archive:Path = None
+        # 已写入的消息数与代码片段数、最近写入的系统提示
+        self.count, self.snippets, self.system = 0, 0, None
+        self.last_fsync = 0.0
+
+    @staticmethod
+    def read(path:Path) -> tuple[dict[str, list], Path]:
+        '''
+            流式读取日志，返回 (历史记录, 归档路径)；忽略末尾未写完的行
+        '''
+        history, archive = {'history': [], 'snippet': []}, None
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                match record['t']:
+                    case 'meta':
+                        archive = Path(record['archive']) if record.get('archive') else None
+                        if archive is not None and record.get('base') is not None:
+                            base, (count, snippets) = read_archive(archive), record['base']
+                            history = {'history': base['history'][:count], 'snippet': base['snippet'][:snippets]}
+                    case 'system':
+                        if len(history['history']) > 0 and history['history'][0]['role'] == 'system':
+                            history['history'][0]['content'] = record['data']
+                        else:
+                            history['history'].insert(0, {"role": "system", "content": record['data']})
+                    case 'message':
+                        history['history'].append(record['data'])
+                    case 'snippet':
+                        history['snippet'].append(record['data'])
+                    case 'reset':
+                        history = {'history': [], 'snippet': []}
+        return history, archive
+
+    def _write(self, kind:str, data=None, **extra):
+        record = {"t": kind} | extra
+        if data is not None:
+            record["data"] = data
+        # 紧凑的消息记录（messages.Message）按字典写入
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=dict) + '\n')
+
+    def open(self, history:dict[str, list], archive:Path=None):
+        '''
+            以当前历史记录的快照开始新的日志
+        '''
+        self.close()
+        self.archive = archive
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self._write('meta', archive=None if archive is None else str(archive), time=time.time())
+        self.count, self.snippets, self.system = 0, 0, None
+        self.sync(history, force=True)
+
+    def attach(self, history:dict[str, list], archive:Path):
+        '''
+            继续一个已归档（或正在后台归档）的会话：只写入日志头，之后只追加新增的内容
+        '''
+        self.close()
+        self.archive = archive
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.count, self.snippets = len(history['history']), len(history['snippet'])
+        self._write('meta', archive=str(archive), base=[self.count, self.snippets], time=time.time())
+        messages = history['history']
+        self.system = messages[0]['content'] if len(messages) > 0 and messages[0]['role'] == 'system' else None
+        self.file.flush()
+
+    def sync(self, history:dict[str, list], force:bool=False):
+        '''
+            追加写入上次同步后新增的消息与代码片段
+        '''
+        if self.file is None:
+            return self.open(history, self.archive)
+        messages, snippets = history['history'], history['snippet']
+        if len(messages) < self.count or len(snippets) < self.snippets:
+            self._write('reset')
+            self.count, self.snippets, self.system = 0, 0, None
+        start = self.count
+        if len(messages) > 0 and messages[0]['role'] == 'system':
+            if messages[0]['content'] != self.system:
+                self.system = messages[0]['content']
+                self._write('system', self.system)
+            start = max(start, 1)
+        for message in messages[start:]:
+            self._write('message', message)
+        for snippet in snippets[self.snippets:]:
+            self._write('snippet', snippet)
+        self.count, self.snippets = len(messages), len(snippets)
+        self.file.flush()
+        if force or time.time() - self.last_fsync >= self.interval:
+            os.fsync(self.file.fileno())
+            self.last_fsync = time.time()
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+    def park(self) -> Path:
+        '''
+            关闭日志并改名保留，会话在后台归档完成后再删除；返回改名后的路径
+        '''
+        self.close()
+        self.archive = None
+        if not self.path.exists():
+            return None
+        target = self._parked_name()
+        os.replace(self.path, target)
+        return target
+
+    def _parked_name(self) -> Path:
+        return self.base.with_name(f"{self.base.stem}.{os.getpid()}.{time.time_ns()}{self.base.suffix}")
+
+    @staticmethod
+    def _owned(path:Path, parts:int) -> list[Path]:
+        '''
+            所属进程已退出的日志：文件名由 parts 段组成，第二段为进程号
+        '''
+        path, found = Path(path), []
+        for p in path.parent.glob(f"{path.stem}.*{path.suffix}"):
+            names = p.name.split('.')
+            if len(names) != parts or not names[1].isdigit():
+                continue
+            pid = int(names[1])
+            if pid == os.getpid():
+                # 进程号被复用：当前进程尚未打开日志，该文件属于之前已退出的进程
+                found.append(p)
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                found.append(p)
+            except PermissionError:
+                continue
+        return found
+
+    @staticmethod
+    def parked(path:Path) -> list[Path]:
+        '''
+            已退出的进程留下的、尚未归档的日志
+        '''
+        return sorted(SessionLog._owned(path, 4))
+
+    @staticmethod
+    def orphans(path:Path) -> list[Path]:
+        '''
+            崩溃的进程留下的会话日志（包括旧版所有进程共用的 path），按修改时间排序
+        '''
+        found = SessionLog._owned(path, 3)
+        if Path(path).exists():
+            found.append(Path(path))
+        return sorted(found, key=lambda p: p.stat().st_mtime)
+
+    def claim(self, path:Path, current:bool=True) -> Path:
+        '''
+            通过改名认领其他进程留下的日志，避免多个进程同时恢复同一个日志：
+            current 时作为本进程的会话日志，否则作为本进程待归档的日志。返回新路径，已被认领时返回 None
+        '''
+        target = self.path if current else self._parked_name()
+        try:
+            os.replace(path, target)
+        except FileNotFoundError:
+            return None
+        return target
+
+    def discard(self):
+        '''
+            关闭并删除日志（会话已归档）
+        '''
+        self.close()
+        self.archive = None
+        if self.path.exists():
+            os.remove(self.path)
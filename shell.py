@@ -0,0 +1,121 @@
+'''
+    常驻的 bash 会话
+
+    每条命令写入临时脚本后在会话中 source 执行，输出重定向到执行器指定的文件；
+    命令结束后在控制管道上输出带随机标记的结束行，携带退出码与当前目录。
+    cd、export 等状态在多次调用之间保留。
+'''
+import os
+import uuid
+import shlex
+import signal
+import tempfile
+import threading
+import subprocess
+
+class Shell:
+    '''
+        常驻 bash 会话的父进程端
+        restrict: 会话启动后以进程号调用，用于设置资源限制
+    '''
+    def __init__(self, shell:str='bash', restrict=None):
+        self.shell, self.restrict = shell, restrict
+        self.proc, self.sentinel = None, None
+        # 会话当前目录，以及上次同步时 Agent 的工作目录
+        self._cwd, self.base = None, None
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def start(self):
+        self.sentinel = f"__AG_DONE_{uuid.uuid4().hex}"
+        self._cwd = self.base = os.getcwd()
+        self.proc = subprocess.Popen(
+            [self.shell, '--noprofile', '--norc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, start_new_session=True, cwd=self._cwd
+        )
+        if self.restrict is not None:
+            self.restrict(self.proc.pid)
+        # 中断时结束当前脚本而不退出会话
+        self._write("trap 'return 130 2>/dev/null' INT\n")
+        self.count = 0
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    @property
+    def cwd(self) -> str:
+        '''
+            会话的当前目录；Agent 切换过工作目录时以 Agent 为准
+        '''
+        if not self.alive() or os.getcwd() != self.base:
+            return os.getcwd()
+        return self._cwd
+
+    def _write(self, text:str):
+        self.proc.stdin.write(text)
+        self.proc.stdin.flush()
+
+    def run(self, code:str, stdout:str, stderr:str) -> int:
+        '''
+            在会话中执行命令，输出追加到 stdout/stderr 文件，返回退出码
+        '''
+        with self.lock:
+            if not self.alive():
+                self.start()
+            with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as f:
+                f.write(code + '\n')
+            try:
+                if os.getcwd() != self.base:
+                    self.base = os.getcwd()
+                    self._write(f"cd {shlex.quote(self.base)}\n")
+                self._write(
+                    f"{{ . {shlex.quote(f.name)}\n}} </dev/null >>{shlex.quote(stdout)} 2>>{shlex.quote(stderr)}\n"
+                    f"printf '\\n{self.sentinel} %d %s\\n' \"$?\" \"$PWD\"\n"
+                )
+                while True:
+                    line = self.proc.stdout.readline()
+                    if line == '':
+                        # 会话已退出（如命令中执行了 exit），下次调用时重新启动
+                        code = self.proc.wait()
+                        with open(stderr, 'a', encoding='utf-8') as err:
+                            err.write(f"Shell exited with code {code}, the session has been reset.\n")
+                        self.proc = None
+                        return code
+                    if line.startswith(self.sentinel):
+                        _, code, cwd = line.rstrip('\n').split(' ', 2)
+                        self._cwd = cwd
+                        self.count += 1
+                        return int(code)
+            except BrokenPipeError:
+                self.proc = None
+                return -1
+            finally:
+                os.remove(f.name)
+
+    def interrupt(self):
+        '''
+            中断正在执行的命令（向整个进程组发送 SIGINT）
+        '''
+        if self.alive():
+            os.killpg(self.proc.pid, signal.SIGINT)
+
+    def kill(self):
+        '''
+            强制结束会话及其中的所有进程，正在等待的调用随即返回，下次调用时重新启动
+        '''
+        if self.alive():
+            os.killpg(self.proc.pid, signal.SIGKILL)
+
+    def restart(self):
+        with self.lock:
+            self.close()
+            self.start()
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.proc.wait()
+        self.proc = None
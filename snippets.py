@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+
+class SnippetStore:
+    '''
+        按内容寻址的代码片段库：每个片段按哈希存储一次，$S<n> 指向片段内容对应的文件
+        directory/
+            <hash>       : 代码片段内容，相同内容只存储一次
+            library.jsonl: 片段索引（哈希、语言、首次出现时间），跨会话检索
+        每轮对话后只写入新的片段、只更新变化的环境变量
+    '''
+    def __init__(self, directory:Path):
+        self.directory = Path(directory)
+        self.index = self.directory / "library.jsonl"
+        # 已导出为 $S<n> 的 (代码, 哈希)
+        self.exported:list[tuple[str, str]] = []
+        self._known:set[str] = None
+
+    @staticmethod
+    def digest(code:str) -> str:
+        return hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()[:16]
+
+    def path(self, digest:str) -> Path:
+        return self.directory / digest
+
+    @property
+    def known(self) -> set[str]:
+        if self._known is None:
+            self._known = {record['hash'] for record in self.records()}
+        return self._known
+
+    def records(self) -> list[dict]:
+        '''
+            读取片段索引，忽略末尾未写完的行
+        '''
+        if not self.index.exists():
+            return []
+        records = []
+        with open(self.index, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def add(self, snippet:dict) -> str:
+        '''
+            存储代码片段（已存在时跳过），返回哈希
+        '''
+        digest = self.digest(snippet['code'])
+        path = self.path(digest)
+        if not path.exists():
+            os.makedirs(self.directory, exist_ok=True)
+            temp = path.with_name(digest + '.tmp')
+            with open(temp, "w", encoding="utf-8") as f:
+                f.write(snippet['code'])
+            os.replace(temp, path)
+        if digest not in self.known:
+            self.known.add(digest)
+            first = next((line.strip() for line in snippet['code'].splitlines() if line.strip()), '')
+            with open(self.index, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"hash": digest, "lang": snippet.get('lang', ''), "time": time.time(),
+                                    "lines": snippet['code'].count('\n') + 1, "first": first[:120]},
+                                   ensure_ascii=False) + '\n')
+        return digest
+
+    def export(self, snippets:list[dict]):
+        '''
+            将当前会话的代码片段同步为环境变量 $S<n>
+        '''
+        for sid, snippet in enumerate(snippets):
+            if sid < len(self.exported) and self.exported[sid][0] is snippet['code']:
+                continue
+            digest = self.add(snippet)
+            if sid < len(self.exported) and self.exported[sid][1] == digest:
+                self.exported[sid] = (snippet['code'], digest)
+                continue
+            os.environ[f'S{sid}'] = str(self.path(digest))
+            if sid < len(self.exported):
+                self.exported[sid] = (snippet['code'], digest)
+            else:
+                self.exported.append((snippet['code'], digest))
+        # 会话切换或清空后，移除多余的变量
+        for sid in range(len(snippets), len(self.exported)):
+            os.environ.pop(f'S{sid}', None)
+        del self.exported[len(snippets):]
+
+    def search(self, query:str, lang:str=None, limit:int=20) -> list[dict]:
+        '''
+            在片段库中搜索包含所有关键词的代码片段（不区分大小写），按时间从新到旧排列
+        '''
+        terms = query.lower().split()
+        found, seen = [], set()
+        for record in reversed(self.records()):
+            if record['hash'] in seen or (lang and record['lang'] != lang):
+                continue
+            seen.add(record['hash'])
+            try:
+                with open(self.path(record['hash']), encoding="utf-8") as f:
+                    code = f.read()
+            except OSError:
+                continue
+            text = code.lower()
+            if all(t in text for t in terms):
+                found.append(record | {"code": code, "path": str(self.path(record['hash']))})
+                if len(found) >= limit:
+                    break
+        return found
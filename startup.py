@@ -0,0 +1,80 @@
+'''
+    启动耗时分析（ag --startup-profile）
+
+    替换 builtins.__import__，记录每个模块首次导入的累计耗时与自身耗时（不含其导入的子模块），
+    并区分主线程与后台预热线程中的导入。
+'''
+import sys
+import time
+import builtins
+import threading
+
+class ImportProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.original = builtins.__import__
+        # 模块名 -> [累计耗时, 自身耗时, 线程名, 导入深度]
+        self.records:dict[str, list] = {}
+        self.marks:dict[str, float] = {}
+        self.local = threading.local()
+
+    def install(self):
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        builtins.__import__ = self.original
+
+    def mark(self, name:str):
+        '''
+            记录一个时间点（相对于开始分析的时间）
+        '''
+        self.marks[name] = time.perf_counter() - self.start
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level > 0:
+            package = (globals or {}).get('__package__') or ''
+            full = package.rsplit('.', level - 1)[0] + ('.' + name if name else '') if package else name
+        else:
+            full = name
+        if full in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(0.0)
+        begin = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - begin
+            children = stack.pop()
+            if len(stack) > 0:
+                stack[-1] += total
+            if full not in self.records:
+                self.records[full] = [total, total - children, threading.current_thread().name, len(stack)]
+
+    def report(self, top:int=15):
+        def ms(t:float) -> str:
+            return f"{t * 1000:9.1f} ms"
+        def pad(text:str, width:int) -> str:
+            # 中文字符占两列
+            used = sum(2 if ord(c) > 0x2E80 else 1 for c in text)
+            return text + ' ' * max(1, width - used)
+        # 最外层导入的累计耗时已包含其子模块
+        main = sum(r[0] for r in self.records.values() if r[2] == 'MainThread' and r[3] == 0)
+        print("╭─  󱎫  启动分析")
+        for name, t in list(self.marks.items()) + [("主线程导入", main)]:
+            print(f"├─  {pad(name, 40)}{ms(t)}")
+        print(f"├─  {pad('模块', 40)}{'累计':>10}{'自身':>11}  线程")
+        records = sorted(self.records.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        for name, (total, own, thread, _) in records:
+            print(f"│   {pad(name, 40)}{ms(total)}{ms(own)}  {thread}")
+        print("╰─────────────")
+
+# 启动时由 ag.py 根据命令行参数创建
+profile:ImportProfile = None
+
+def begin():
+    global profile
+    profile = ImportProfile()
+    profile.install()
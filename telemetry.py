@@ -0,0 +1,176 @@
+import os
+import json
+import time
+
+from _global import *
+
+# 块间间隔直方图的分桶边界（毫秒），最后一个桶为 >= 1000ms
+GAP_BUCKETS = [10, 25, 50, 100, 250, 500, 1000]
+
+class Meter:
+    '''
+        单次请求的延迟与吞吐统计
+    '''
+    def __init__(self, model:str, mode:str='chat'):
+        self.model, self.mode = model, mode
+        self.start = time.time()
+        self.connect, self.ttft, self.total = None, None, None
+        self.last = None
+        self.gaps = [0] * (len(GAP_BUCKETS) + 1)
+        # [首块时间, 末块时间, 块数]
+        self.spans = {True: [None, None, 0], False: [None, None, 0]}
+        self.usage = None
+        self.error = None
+        # 实际使用的端点（router.Endpoint）
+        self.endpoint = None
+        # 端点自身的首字延迟（从向该端点发起请求起计），对冲时不含等待之前请求的时间
+        self.endpoint_ttft = None
+
+    def connected(self, at:float=None):
+        '''
+            记录连接建立（请求返回）的时间
+        '''
+        self.connect = (at or time.time()) - self.start
+
+    def chunk(self, reasoning:bool, content:str):
+        '''
+            记录一个数据块
+        '''
+        if content == '':
+            return
+        now = time.time()
+        if self.ttft is None:
+            self.ttft = now - self.start
+        if self.last is not None:
+            gap, bucket = (now - self.last) * 1000, 0
+            while bucket < len(GAP_BUCKETS) and gap >= GAP_BUCKETS[bucket]:
+                bucket += 1
+            self.gaps[bucket] += 1
+        self.last = now
+        span = self.spans[reasoning]
+        if span[0] is None:
+            span[0] = now
+        span[1] = now
+        span[2] += 1
+
+    def record_usage(self, usage):
+        '''
+            记录 stream_options.include_usage 返回的用量
+        '''
+        details = getattr(usage, 'completion_tokens_details', None)
+        self.usage = {
+            "prompt"    : getattr(usage, 'prompt_tokens', None),
+            "completion": getattr(usage, 'completion_tokens', None),
+            "reasoning" : getattr(details, 'reasoning_tokens', None),
+            "total"     : getattr(usage, 'total_tokens', None)
+        }
+
+    def _tokens(self, reasoning:bool):
+        '''
+            输出的 token 数，优先使用接口返回的用量，否则以数据块数估计
+        '''
+        count = self.spans[reasoning][2]
+        if self.usage is None or self.usage['completion'] is None:
+            return count
+        rtok = self.usage['reasoning']
+        if rtok is None:
+            # 无思考用量时，按块数比例分配
+            blocks = self.spans[True][2] + self.spans[False][2]
+            return round(self.usage['completion'] * count / blocks) if blocks > 0 else 0
+        return rtok if reasoning else self.usage['completion'] - rtok
+
+    def _tps(self, reasoning:bool):
+        first, last, count = self.spans[reasoning]
+        if count < 2 or last <= first:
+            return None
+        return self._tokens(reasoning) / (last - first)
+
+    def finish(self, error:str=None) -> dict:
+        '''
+            结束统计，追加写入统计文件并返回记录
+        '''
+        self.total = time.time() - self.start
+        self.error = error
+        record = {
+            "time"   : round(self.start, 3),
+            "model"  : self.model,
+            "mode"   : self.mode,
+            "host"   : None if self.endpoint is None else self.endpoint.host,
+            "connect": _round(self.connect),
+            "ttft"   : _round(self.ttft),
+            "total"  : _round(self.total),
+            "rtok"   : self._tokens(True),
+            "atok"   : self._tokens(False),
+            "rtps"   : _round(self._tps(True), 1),
+            "atps"   : _round(self._tps(False), 1),
+            "gaps"   : self.gaps,
+            "usage"  : self.usage
+        }
+        if error is not None:
+            record["error"] = error
+        try:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            with open(STATS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        except OSError:
+            pass
+        return record
+
+    def summary(self) -> str:
+        '''
+            单行摘要，显示在回复的底部边框
+        '''
+        parts = []
+        if self.ttft is not None:
+            parts.append(f"首字 {self.ttft:.2f}s")
+        tps = self._tps(False) or self._tps(True)
+        if tps is not None:
+            parts.append(f"{tps:.1f} tok/s")
+        if self.usage is not None and self.usage['total'] is not None:
+            parts.append(f"{self.usage['total']} tokens")
+        if self.total is not None:
+            parts.append(f"共 {self.total:.1f}s")
+        return ' · '.join(parts)
+
+    def border(self) -> str:
+        summary = self.summary()
+        return '╰─────────────' + (f'  󱎫 {summary}' if summary else '')
+
+def _round(v, n:int=3):
+    return None if v is None else round(v, n)
+
+def load_stats() -> list[dict]:
+    '''
+        读取统计文件
+    '''
+    records = []
+    if not STATS_FILE.exists():
+        return records
+    with open(STATS_FILE, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+def aggregate(records:list[dict]) -> dict[str, dict]:
+    '''
+        按模型汇总 p50/p95 指标
+    '''
+    import numpy as np
+
+    models:dict[str, list[dict]] = {}
+    for r in records:
+        models.setdefault(r['model'], []).append(r)
+    result = {}
+    for model, rs in models.items():
+        item = {"count": len(rs), "errors": sum(1 for r in rs if r.get('error'))}
+        for key in ['connect', 'ttft', 'total', 'atps', 'rtps']:
+            values = np.array([r[key] for r in rs if r.get(key) is not None], dtype=float)
+            item[key] = None if values.size == 0 else \
+                (float(np.percentile(values, 50)), float(np.percentile(values, 95)))
+        item['gaps'] = np.sum([r['gaps'] for r in rs if r.get('gaps')], axis=0).tolist() \
+            if any(r.get('gaps') for r in rs) else None
+        result[model] = item
+    return result
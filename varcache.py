@@ -0,0 +1,121 @@
+import os
+import glob
+import time
+import threading
+
+class VarCache:
+    '''
+        终端命令变量的结果缓存，每个变量可以设置新鲜度策略：
+            {"mode": "always"}                     : 每次使用时执行（默认）
+            {"mode": "ttl", "ttl": 秒}              : 缓存结果，超过有效期后重新执行
+            {"mode": "watch", "paths": [路径...]}   : 缓存结果，文件（支持通配符）修改后重新执行
+            {"mode": "refresh", "interval": 秒}     : 后台定时刷新，使用时直接返回缓存结果
+        run(command, background) 执行命令并返回结果，后台刷新时 background 为 True
+    '''
+    MODES = ['always', 'ttl', 'watch', 'refresh']
+
+    def __init__(self, run):
+        self.run = run
+        self.lock = threading.Lock()
+        # 变量名 -> {"command", "value", "time", "fingerprint"}
+        self.entries:dict[str, dict] = {}
+        self.threads:dict[str, tuple[threading.Thread, threading.Event]] = {}
+
+    @staticmethod
+    def fingerprint(paths:list[str]) -> tuple:
+        '''
+            被监视文件的 (路径, 修改时间)
+        '''
+        found = []
+        for pattern in paths:
+            for path in sorted(glob.glob(os.path.expanduser(pattern))) or [pattern]:
+                try:
+                    found.append((path, os.stat(path).st_mtime_ns))
+                except OSError:
+                    found.append((path, None))
+        return tuple(found)
+
+    def _fresh(self, entry:dict, command:str, policy:dict) -> bool:
+        if entry is None or entry['command'] != command:
+            return False
+        match policy.get('mode', 'always'):
+            case 'ttl':
+                return time.time() - entry['time'] < policy.get('ttl', 60)
+            case 'watch':
+                return entry['fingerprint'] == self.fingerprint(policy.get('paths', []))
+            case 'refresh':
+                return True
+        return False
+
+    def _store(self, name:str, command:str, policy:dict, background:bool=False) -> str:
+        fingerprint = self.fingerprint(policy.get('paths', [])) if policy.get('mode') == 'watch' else None
+        value = self.run(command, background)
+        with self.lock:
+            self.entries[name] = {"command": command, "value": value, "time": time.time(),
+                                  "fingerprint": fingerprint}
+        return value
+
+    def get(self, name:str, command:str, policy:dict=None, background:bool=False) -> str:
+        '''
+            按策略返回变量的值：缓存仍然新鲜时直接返回，否则执行命令
+            在后台线程中调用时 background 为 True，命令不读取终端输入
+        '''
+        policy = policy or {}
+        with self.lock:
+            entry = self.entries.get(name)
+        if self._fresh(entry, command, policy):
+            return entry['value']
+        value = self._store(name, command, policy, background)
+        if policy.get('mode') == 'refresh':
+            self.watch(name, command, policy)
+        return value
+
+    def age(self, name:str) -> float:
+        '''
+            缓存结果的时长（秒），没有缓存时返回 None
+        '''
+        with self.lock:
+            entry = self.entries.get(name)
+        return None if entry is None else time.time() - entry['time']
+
+    def watch(self, name:str, command:str, policy:dict):
+        '''
+            启动变量的后台刷新（已启动时跳过）
+        '''
+        stop = threading.Event()
+        def loop():
+            while not stop.wait(policy.get('interval', 60)):
+                try:
+                    self._store(name, command, policy, background=True)
+                except Exception:
+                    continue
+        with self.lock:
+            if name in self.threads and self.threads[name][0].is_alive():
+                return
+            thread = threading.Thread(target=loop, name=f"var-{name}", daemon=True)
+            self.threads[name] = (thread, stop)
+        thread.start()
+
+    def start(self, commands:dict[str, str], policies:dict[str, dict]):
+        '''
+            为所有后台刷新的变量启动刷新线程，首次结果在后台获取
+        '''
+        for name, policy in policies.items():
+            if policy.get('mode') == 'refresh' and name in commands:
+                threading.Thread(target=self.get, args=(name, commands[name], policy, True), daemon=True).start()
+
+    def invalidate(self, name:str):
+        '''
+            删除变量的缓存并停止后台刷新
+        '''
+        with self.lock:
+            self.entries.pop(name, None)
+            thread = self.threads.pop(name, None)
+        if thread is not None:
+            thread[1].set()
+
+    def close(self):
+        with self.lock:
+            for _, stop in self.threads.values():
+                stop.set()
+            self.threads.clear()